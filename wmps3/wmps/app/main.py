@@ -1,24 +1,32 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import asyncio
+import atexit
+import codecs
 import csv
 import json
 import os
+import queue
+import select
 import time
 import threading
 import urllib.request, urllib.error
 import fcntl
-import glob
+import io
+import hashlib
+import heapq
+import itertools
 import shutil
 import socket
 import ssl
+import tempfile
 import traceback
-from collections import deque
 
 from contextlib import contextmanager
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, Optional, Union, List, Tuple
+from typing import Callable, Dict, Iterator, Optional, Union, List, Tuple
 
 # Optional imports (guarded)
 try:
@@ -39,8 +47,20 @@ try:
 except Exception:
     _HAS_WS = False
 
+try:
+    import httpx  # pooled keep-alive client for HA REST calls
+    _HAS_HTTPX = True
+except Exception:
+    _HAS_HTTPX = False
+
+try:
+    import orjson  # faster JSON encode/decode, bytes in and out
+    _HAS_ORJSON = True
+except Exception:
+    _HAS_ORJSON = False
+
 from fastapi import FastAPI, Query, HTTPException, Request, Body
-from starlette.responses import JSONResponse, PlainTextResponse, HTMLResponse, StreamingResponse
+from starlette.responses import Response, JSONResponse, PlainTextResponse, HTMLResponse, FileResponse, StreamingResponse
 
 # ----------------------- PATHS ---------------------------
 DATA_DIR = Path("/data")
@@ -62,6 +82,9 @@ TRANSACTIONS_HEADER = "timestamp,tenant_code,machine_number,amount_charged,balan
 # ADAM-6050 mapping: DO0..DO5 are Modbus coils 16..21
 ADAM_COIL_BASE = 16
 
+# Binary HA states accepted as authoritative in /machines
+_ONOFF = frozenset(("on", "off"))
+
 ACTIVE_UNTIL: Dict[str, float] = {}
 LAST_TRIGGER_AT: Dict[str, float] = {}
 IDEMPOTENCY_CACHE: Dict[str, float] = {}
@@ -70,14 +93,35 @@ app = FastAPI(title="WMPS API", version="3.2.0")
 
 # ----------------------- Logging -------------------------
 
+# Last (configured token, resolved token); the configured value only changes
+# on a config save and SUPERVISOR_TOKEN is fixed for the container's lifetime.
+_TOKEN_MEMO: Tuple[object, Optional[str]] = (object(), None)
+
 def _resolve_token(cfg_token: Optional[str]) -> Optional[str]:
-    t = (cfg_token or "").strip()
-    if t:
-        return t
-    return os.environ.get("SUPERVISOR_TOKEN")
+    global _TOKEN_MEMO
+    memo = _TOKEN_MEMO
+    if memo[0] == cfg_token:
+        return memo[1]
+    t = (cfg_token or "").strip() or os.environ.get("SUPERVISOR_TOKEN")
+    _TOKEN_MEMO = (cfg_token, t)
+    return t
+
 
 
 
+def _json_dumps(obj, indent: bool = False) -> bytes:
+    """Serialize to UTF-8 JSON bytes (orjson when available)."""
+    if _HAS_ORJSON:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+        except TypeError:
+            pass  # e.g. non-str keys or ints beyond 64 bits: let json handle it
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _json_loads(data: Union[bytes, str]):
+    return orjson.loads(data) if _HAS_ORJSON else json.loads(data)
 
 # Prefer centralized logger if available
 def _get_logger():
@@ -89,56 +133,171 @@ def _get_logger():
 
 _LOGGER = _get_logger()
 
-_LEVEL_MAP = {
-    "DEBUG": "DEBUG", "INFO": "INFO", "WARN": "WARNING", "WARNING": "WARNING", "ERROR": "ERROR"
-}
+_LEVEL_NO = {"DEBUG": 10, "INFO": 20, "WARN": 30, "WARNING": 30, "ERROR": 40}  # logging.* values
 
 def _log(level: str, msg: str) -> None:
     """Log via app.utils logger if present, else print."""
+    lvl = _LEVEL_NO.get(level.upper(), 20)
+    if lvl < 20 and not _debug_enabled():
+        return
     if _LOGGER:
         try:
-            import logging as _logging  # local import to map level
-            lvl = getattr(_logging, _LEVEL_MAP.get(level.upper(), "INFO"))
             _LOGGER.log(lvl, msg)
             return
         except Exception:
             pass
     print(f"[{datetime.now(timezone.utc).isoformat()}] {level}: {msg}", flush=True)
 
+_DEBUG_ENV = (os.environ.get("WMPS_LOG_LEVEL") or "").upper() == "DEBUG"
+
+def _log_enabled(level: str) -> bool:
+    """True if a `level` line would be emitted; guard costly message formatting with it."""
+    lvl = _LEVEL_NO.get(level.upper(), 20)
+    if _LOGGER is not None:
+        try:
+            return _LOGGER.isEnabledFor(lvl)
+        except Exception:
+            return lvl >= 20
+    return lvl >= 20 or _DEBUG_ENV
+
+def _debug_enabled() -> bool:
+    return _log_enabled("DEBUG")
+
+def _dbg(msg_fn: Callable[[], str]) -> None:
+    """DEBUG line whose text is only built (msg_fn()) when DEBUG is enabled."""
+    if _debug_enabled():
+        _log("DEBUG", msg_fn())
+
 # ----------------------- Options / Config ----------------
+# Parsed options.json, keyed by (mtime_ns, size); swapped as one tuple so
+# readers never see a stamp paired with the wrong value.
+_OPTIONS_CACHE: Tuple[Optional[Tuple[int, int]], dict] = (None, {})
+_OPTIONS_LOCK = threading.Lock()
+
 def _read_options() -> dict:
-    if not OPTIONS_PATH.exists():
-        return {}
+    """Return options.json, re-parsed only when the file changed.
+
+    The returned dict is shared between callers; copy it before mutating.
+    """
+    global _OPTIONS_CACHE
     try:
-        return json.loads(OPTIONS_PATH.read_text(encoding="utf-8") or "{}")
+        st = OPTIONS_PATH.stat()
+    except FileNotFoundError:
+        return {}
     except Exception as e:
-        _log("WARN", f"Failed to read options.json: {e}")
+        _log("WARN", f"Failed to stat options.json: {e}")
         return {}
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached_stamp, cached = _OPTIONS_CACHE
+    if cached_stamp == stamp:
+        return cached
+    with _OPTIONS_LOCK:
+        cached_stamp, cached = _OPTIONS_CACHE
+        if cached_stamp == stamp:
+            return cached
+        try:
+            opts = _json_loads(OPTIONS_PATH.read_bytes() or b"{}")
+        except Exception as e:
+            _log("WARN", f"Failed to read options.json: {e}")
+            return {}
+        _OPTIONS_CACHE = (stamp, opts)
+        return opts
+
+# Keypad hot path: skip even the stat when options were checked within
+# OPTIONS_TTL seconds. _write_options swaps the cache, so saves apply at once;
+# hand edits to options.json show up within the TTL.
+OPTIONS_TTL = 2.0
+_OPTIONS_CHECKED = 0.0
+
+def _read_options_cached() -> dict:
+    global _OPTIONS_CHECKED
+    now = time.monotonic()
+    stamp, cached = _OPTIONS_CACHE
+    if stamp is not None and now - _OPTIONS_CHECKED < OPTIONS_TTL:
+        return cached
+    opts = _read_options()
+    _OPTIONS_CHECKED = now
+    return opts
 
 def _write_options(opts: dict) -> None:
+    """Atomically replace options.json with compact JSON; `opts` becomes the cached value."""
+    global _OPTIONS_CACHE
     tmp = OPTIONS_PATH.with_suffix(".json.tmp")
-    tmp.write_text(json.dumps(opts, indent=2), encoding="utf-8")
-    os.replace(tmp, OPTIONS_PATH)
+    with tmp.open("wb") as f:
+        f.write(_json_dumps(opts))
+        f.flush(); os.fsync(f.fileno())
+    with _OPTIONS_LOCK:
+        os.replace(tmp, OPTIONS_PATH)
+        # Seed the cache with what was written: no re-parse on the next read.
+        # Keyed by the new file's own stamp, so a later edit still reloads.
+        try:
+            st = OPTIONS_PATH.stat()
+            _OPTIONS_CACHE = ((st.st_mtime_ns, st.st_size), opts)
+        except OSError:
+            _OPTIONS_CACHE = (None, {})
     _log("INFO", "options.json updated")
 
+# Paths already known to exist with content; _ensure_file is then free. The
+# transactions appender drops its entry if the file disappears.
+_FILES_READY: set = set()
+
 def _ensure_file(path: Path, header: str) -> None:
+    if path in _FILES_READY:
+        return
     try:
         path.parent.mkdir(parents=True, exist_ok=True)
         if not path.exists() or path.stat().st_size == 0:
+            # No sync: a header-only file is recreated at boot if it is lost
             with path.open("w", encoding="utf-8", newline="") as f:
                 f.write(header)
-                f.flush(); os.fsync(f.fileno())
             _log("INFO", f"Created {path} with header")
+        _FILES_READY.add(path)
     except Exception as e:
         _log("WARN", f"ensure_file failed for {path}: {e}")
 
+FICLONE = getattr(fcntl, "FICLONE", 0x40049409)  # linux/fs.h: reflink clone of a whole file
+
+def _clone_file(src: Path, dst: Path, allow_link: bool = True) -> str:
+    """Create dst (must not exist) with src's content; return how.
+
+    Cheapest first: hard link (same filesystem, only if allow_link), reflink
+    clone (btrfs/XFS), then a byte copy. A link shares the inode, so use it
+    only for private read-only snapshots, never for files users can edit.
+    """
+    if allow_link:
+        try:
+            os.link(src, dst)
+            return "link"
+        except OSError:
+            pass
+    try:
+        with open(src, "rb") as fs, open(dst, "wb") as fd:
+            fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+        how = "reflink"
+    except OSError:
+        shutil.copyfile(src, dst)
+        how = "copy"
+    # Preserve mtime/metadata where possible (as copy2 did)
+    try:
+        shutil.copystat(src, dst)
+    except OSError:
+        pass
+    return how
+
 def _mirror(src: Path, dst: Path) -> None:
-    """Mirror src file to dst (atomic best-effort)."""
+    """Mirror src file to dst (atomic best-effort) via _clone_file + os.replace.
+
+    The /share copies are user-editable (Samba), so they never share an inode
+    with the live file: reflink or copy only. An existing hard-linked mirror
+    is replaced by a separate copy.
+    """
     try:
         dst.parent.mkdir(parents=True, exist_ok=True)
-        # Use copy2 to preserve mtime/metadata where possible
-        shutil.copy2(src, dst)
-        _log("INFO", f"Mirrored {src} -> {dst}")
+        tmp = dst.with_name(dst.name + ".mirror")
+        tmp.unlink(missing_ok=True)
+        how = _clone_file(src, tmp, allow_link=False)
+        os.replace(tmp, dst)
+        _log("INFO", f"Mirrored {src} -> {dst} ({how})")
     except Exception as e:
         _log("WARN", f"Mirror failed {src} -> {dst}: {e}")
 
@@ -147,7 +306,7 @@ def ensure_bootstrap_files() -> None:
     _ensure_file(ACCOUNTS_PATH, ACCOUNTS_HEADER)
     _ensure_file(TRANSACTIONS_PATH, TRANSACTIONS_HEADER)
     _mirror(ACCOUNTS_PATH, SHARE_ACCOUNTS)
-    _mirror(TRANSACTIONS_PATH, SHARE_TX)
+    _schedule_tx_mirror()
 
     # options bootstrap (idempotent)
     if not OPTIONS_PATH.exists():
@@ -195,83 +354,223 @@ def ensure_bootstrap_files() -> None:
                 {"id": 6, "ha_switch": "switch.dryer_6_control",  "ha_sensor": "binary_sensor.dryer_6_status",  "relay": 5, "di": 5, "enabled": True}
             ]
         }
-        OPTIONS_PATH.write_text(json.dumps(default, indent=2), encoding="utf-8")
+        OPTIONS_PATH.write_bytes(_json_dumps(default, indent=True))
         _log("INFO", "Created /data/options.json with defaults")
 
 # ----------------------- Locks ---------------------------
+# Lock files stay open for the life of the process: one fd per path, paired
+# with a thread lock because flock() does not exclude threads sharing an fd.
+_LOCK_FDS: Dict[str, Tuple[threading.Lock, int]] = {}
+LOCK_SPINS = 200 if (os.cpu_count() or 1) > 1 else 0
+_LOCK_FDS_LOCK = threading.Lock()
+
+def _lock_entry(path: Path) -> Tuple[threading.Lock, int]:
+    key = str(path)
+    entry = _LOCK_FDS.get(key)
+    if entry is None:
+        with _LOCK_FDS_LOCK:
+            entry = _LOCK_FDS.get(key)
+            if entry is None:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                fd = os.open(key, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+                entry = _LOCK_FDS[key] = (threading.Lock(), fd)
+    return entry
+
 @contextmanager
 def file_lock(path: Path, timeout: float = 10.0):
-    path.parent.mkdir(parents=True, exist_ok=True)
-    fd = os.open(str(path), os.O_RDWR | os.O_CREAT, 0o644)
+    tlock, fd = _lock_entry(path)
     start = time.monotonic()
+    if not tlock.acquire(timeout=timeout):
+        raise TimeoutError(f"Could not acquire lock {path} within {timeout}s")
     try:
+        # Holders keep the lock for microseconds: spin briefly, then back off
+        # from 0.5 ms up to 50 ms per retry
+        spins = 0
+        delay = 0.0005
         while True:
             try:
                 fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
                 break
             except BlockingIOError:
-                if time.monotonic() - start > timeout:
+                if spins < LOCK_SPINS:
+                    spins += 1
+                    os.sched_yield()
+                    continue
+                remaining = timeout - (time.monotonic() - start)
+                if remaining <= 0:
                     raise TimeoutError(f"Could not acquire lock {path} within {timeout}s")
-                time.sleep(0.05)
-        yield
-    finally:
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, 0.05)
         try:
-            fcntl.flock(fd, fcntl.LOCK_UN)
-        except Exception:
-            pass
-        os.close(fd)
+            yield
+        finally:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            except Exception:
+                pass
+    finally:
+        tlock.release()
 
 # ----------------------- Helpers -------------------------
+# Headers for the last token used. Rotating the token in the config simply
+# builds a new dict on the next call. Callers must not mutate the result.
+_HA_HEADERS: Tuple[Optional[str], dict] = (None, {})
+
 def _ha_headers(token: str) -> dict:
-    return {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    global _HA_HEADERS
+    memo = _HA_HEADERS
+    if memo[0] == token:
+        return memo[1]
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    _HA_HEADERS = (token, headers)
+    return headers
+
+# One keep-alive connection pool shared by all HA REST calls, so polling and
+# service calls after the first skip the TCP/TLS handshake. Falls back to
+# urllib (one connection per call) when httpx is unavailable.
+_HA_HTTP = None
+_HA_HTTP_LOCK = threading.Lock()
+
+def _ha_http():
+    global _HA_HTTP
+    if not _HAS_HTTPX:
+        return None
+    if _HA_HTTP is None:
+        with _HA_HTTP_LOCK:
+            if _HA_HTTP is None:
+                _HA_HTTP = httpx.Client(
+                    transport=httpx.HTTPTransport(retries=2),  # connect retries only
+                    limits=httpx.Limits(max_connections=16, max_keepalive_connections=8),
+                )
+    return _HA_HTTP
+
+def _ha_parse(body: bytes) -> dict:
+    try:
+        return _json_loads(body or b"{}")
+    except Exception:
+        return {"raw": body.decode("utf-8","ignore")}
+
+def _ha_json(resp) -> dict:
+    """Decode an httpx response body straight from bytes."""
+    if not resp.content:
+        return {}
+    try:
+        return _json_loads(resp.content)
+    except ValueError:
+        return {"raw": resp.text}
 
 def _ha_call_service(ha_url: str, token: str, domain: str, service: str, payload: dict) -> dict:
     url = f"{ha_url.rstrip('/')}/api/services/{domain}/{service}"
-    data = json.dumps(payload).encode("utf-8")
+    client = _ha_http()
+    if client is not None:
+        resp = client.post(url, content=_json_dumps(payload), headers=_ha_headers(token), timeout=10)
+        resp.raise_for_status()
+        return _ha_json(resp)
+    data = _json_dumps(payload)
     req = urllib.request.Request(url, data=data, headers=_ha_headers(token), method="POST")
     with urllib.request.urlopen(req, timeout=10) as resp:
-        body = resp.read()
-        try:
-            return json.loads(body.decode("utf-8") or "{}")
-        except Exception:
-            return {"raw": body.decode("utf-8","ignore")}
+        return _ha_parse(resp.read())
 
 def _ha_get_state(ha_url: str, token: str, entity_id: str) -> dict:
     url = f"{ha_url.rstrip('/')}/api/states/{entity_id}"
+    client = _ha_http()
+    if client is not None:
+        resp = client.get(url, headers=_ha_headers(token), timeout=5)
+        resp.raise_for_status()
+        return _ha_json(resp)
     req = urllib.request.Request(url, headers=_ha_headers(token), method="GET")
     with urllib.request.urlopen(req, timeout=5) as resp:
-        body = resp.read()
-        try:
-            return json.loads(body.decode("utf-8") or "{}")
-        except Exception:
-            return {"raw": body.decode("utf-8","ignore")}
+        return _ha_parse(resp.read())
+
+# Seconds-resolution UTC ISO timestamp, formatted once per second. Used for
+# last_transaction_utc and /ping; the ledger keeps full precision.
+_TS_CACHE: Tuple[int, str] = (-1, "")
+
+def _iso_now() -> str:
+    global _TS_CACHE
+    sec = int(time.time())
+    cached = _TS_CACHE
+    if cached[0] == sec:
+        return cached[1]
+    iso = datetime.fromtimestamp(sec, timezone.utc).isoformat()
+    _TS_CACHE = (sec, iso)
+    return iso
 
 def _num_to_text(v) -> str:
-    if v is None or v == "":
+    t = type(v)
+    if t is float or t is int:  # fast path: no str()/replace() round-trip (bool excluded)
+        fv = v
+    elif v is None or v == "":
         return ""
+    else:
+        try:
+            fv = float(str(v).replace(",", "."))
+        except Exception:
+            return str(v)
     try:
-        fv = float(str(v).replace(",", "."))
-        if abs(fv - int(fv)) < 1e-9:
-            return str(int(fv))
-        txt = ("%.2f" % fv)
-        return txt.rstrip("0").rstrip(".") if "." in txt else txt
-    except Exception:
+        iv = int(fv)
+    except (OverflowError, ValueError):  # inf / nan
         return str(v)
+    if abs(fv - iv) < 1e-9:
+        return str(iv)
+    txt = f"{fv:.2f}"
+    return txt.rstrip("0").rstrip(".")
+
+# Derived lookups over an options dict, built once per cached options object
+# so the per-machine helpers below are dict/set lookups instead of list scans.
+_OPTS_INDEX: Tuple[object, dict] = (None, {})
+
+def _opts_index(opts: dict) -> dict:
+    global _OPTS_INDEX
+    cached_opts, idx = _OPTS_INDEX
+    if cached_opts is opts:
+        return idx
+    by_id: Dict[str, dict] = {}
+    for m in opts.get("machines", []) or []:
+        by_id.setdefault(str(m.get("id")), m)  # first entry wins, as the scans did
+    idx = {
+        "machines": by_id,
+        "washing": frozenset(str(x) for x in (opts.get("washing_machines") or [])),
+        "dryer": frozenset(str(x) for x in (opts.get("dryer_machines") or [])),
+        "disabled": frozenset(str(x) for x in (opts.get("disabled_machines") or [])),
+        "price_map": {str(k): v for k, v in (opts.get("price_map") or {}).items()},
+    }
+    # Default cycle minutes for the six keypad machines; others are computed per call
+    minutes: Dict[str, int] = {}
+    try:
+        wash, dry = int(opts.get("washing_minutes", 30)), int(opts.get("dryer_minutes", 60))
+        for i in range(1, 7):
+            mid = str(i)
+            if mid in idx["washing"]:
+                minutes[mid] = wash
+            elif mid in idx["dryer"]:
+                minutes[mid] = dry
+            else:
+                minutes[mid] = wash if i <= 3 else dry
+    except (TypeError, ValueError):
+        minutes = {}  # bad option values: let _default_minutes_for raise as before
+    idx["minutes"] = minutes
+    if opts is _OPTIONS_CACHE[1]:
+        _OPTS_INDEX = (opts, idx)
+    return idx
 
 def _machine_category(machine: str, opts: dict) -> str:
-    washing = [str(x) for x in (opts.get("washing_machines") or [])]
-    dryer = [str(x) for x in (opts.get("dryer_machines") or [])]
-    if str(machine) in washing:
+    idx = _opts_index(opts)
+    mid = str(machine)
+    if mid in idx["washing"]:
         return "washing"
-    if str(machine) in dryer:
+    if mid in idx["dryer"]:
         return "dryer"
-    return "washing" if str(machine) in {"1","2","3"} else "dryer"
+    return "washing" if mid in {"1","2","3"} else "dryer"
 
 def _default_minutes_for(machine: str, opts: dict) -> int:
+    mins = _opts_index(opts)["minutes"].get(str(machine))
+    if mins is not None:
+        return mins
     return int(opts.get("washing_minutes", 30)) if _machine_category(machine, opts)=="washing" else int(opts.get("dryer_minutes", 60))
 
 def _price_for(machine: str, opts: dict) -> float:
-    pm = opts.get("price_map") or {}
+    pm = _opts_index(opts)["price_map"]
     if str(machine) in pm:
         try: return float(pm[str(machine)])
         except: pass
@@ -281,21 +580,21 @@ def _price_for(machine: str, opts: dict) -> float:
     return float(opts.get("price_washing", 5)) if _machine_category(machine, opts)=="washing" else float(opts.get("price_dryer", 5))
 
 def _machine_entities(machine_id: str, opts: dict) -> Tuple[str, str]:
-    for m in opts.get("machines", []) or []:
-        if str(m.get("id")) == str(machine_id):
-            return (m.get("ha_switch") or f"switch.machine_{machine_id}",
-                    m.get("ha_sensor") or f"binary_sensor.machine_{machine_id}_busy")
+    m = _opts_index(opts)["machines"].get(str(machine_id))
+    if m is not None:
+        return (m.get("ha_switch") or f"switch.machine_{machine_id}",
+                m.get("ha_sensor") or f"binary_sensor.machine_{machine_id}_busy")
     return (f"switch.machine_{machine_id}", f"binary_sensor.machine_{machine_id}_busy")
 
 def _machine_adam_mapping(machine_id: str, opts: dict) -> Tuple[Optional[int], Optional[int]]:
     """Return (relay_index, di_index) for ADAM; defaults to id-1 if not provided."""
-    for m in opts.get("machines", []) or []:
-        if str(m.get("id")) == str(machine_id):
-            r = m.get("relay")
-            di = m.get("di")
-            try_r = int(r) if r is not None else int(machine_id) - 1
-            try_di = int(di) if di is not None else int(machine_id) - 1
-            return try_r, try_di
+    m = _opts_index(opts)["machines"].get(str(machine_id))
+    if m is not None:
+        r = m.get("relay")
+        di = m.get("di")
+        try_r = int(r) if r is not None else int(machine_id) - 1
+        try_di = int(di) if di is not None else int(machine_id) - 1
+        return try_r, try_di
     try:
         mid = int(machine_id)
         return mid - 1, mid - 1
@@ -303,10 +602,106 @@ def _machine_adam_mapping(machine_id: str, opts: dict) -> Tuple[Optional[int], O
         return None, None
 
 # ----------------------- CSV I/O -------------------------
+# ----------------------- Accounts write-behind -----------
+# /accounts/upsert stages its change here instead of rewriting accounts.csv;
+# a background flusher writes the pending state at most every
+# ACCOUNTS_FLUSH_INTERVAL seconds. While something is pending, read_accounts()
+# serves it so readers never see the older file.
+ACCOUNTS_FLUSH_INTERVAL = 0.2
+_ACCOUNTS_PENDING: Optional[Dict[str, Dict[str, Union[str, float]]]] = None
+_ACCOUNTS_LOCK = threading.Lock()
+_ACCOUNTS_FLUSHER: Optional[threading.Thread] = None
+
+# Parsed accounts.csv keyed by its stat stamp, so an upload or an external edit
+# (new inode/mtime/size) forces one re-parse. Writers store what they wrote.
+# Cached dicts are never handed out; read_accounts() returns copies.
+_ACCOUNTS_CACHE: Tuple[Optional[Tuple[int, int, int]], Dict[str, Dict[str, Union[str, float]]]] = (None, {})
+
+def _accounts_stamp() -> Optional[Tuple[int, int, int]]:
+    try:
+        st = ACCOUNTS_PATH.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def _cache_accounts(parsed: Dict[str, Dict[str, Union[str, float]]]) -> None:
+    """Record `parsed` as the content of accounts.csv. Call with _ACCOUNTS_LOCK held."""
+    global _ACCOUNTS_CACHE
+    _ACCOUNTS_CACHE = (_accounts_stamp(), parsed)
+
+def _stage_accounts(accounts: Dict[str, Dict[str, Union[str, float]]]) -> None:
+    """Queue a full accounts snapshot for the flusher. Call under GLOBAL_LOCK."""
+    global _ACCOUNTS_PENDING
+    with _ACCOUNTS_LOCK:
+        _ACCOUNTS_PENDING = accounts
+    _start_accounts_flusher()
+
+def _discard_pending_accounts() -> None:
+    """Drop staged changes (accounts.csv was replaced wholesale). Call under GLOBAL_LOCK."""
+    global _ACCOUNTS_PENDING
+    with _ACCOUNTS_LOCK:
+        _ACCOUNTS_PENDING = None
+
+_ACCOUNTS_FLUSH_LOCK = threading.Lock()
+
+def flush_accounts() -> None:
+    """Write staged accounts to disk, if any.
+
+    Staged snapshots are never mutated, so the CSV is serialized and fsynced
+    without GLOBAL_LOCK. The lock is only taken for the rename, which happens
+    only if the snapshot is still the one pending. A newer stage or a
+    synchronous write_accounts() in the meantime makes it stale.
+    """
+    global _ACCOUNTS_PENDING
+    with _ACCOUNTS_FLUSH_LOCK:
+        snapshot = _ACCOUNTS_PENDING
+        if snapshot is None:
+            return
+        tmp = ACCOUNTS_PATH.with_suffix(".csv.flush")
+        try:
+            parsed = _write_accounts_file(snapshot, tmp)
+            with file_lock(GLOBAL_LOCK, timeout=10.0):
+                with _ACCOUNTS_LOCK:
+                    current = _ACCOUNTS_PENDING is snapshot
+                    if current:
+                        os.replace(tmp, ACCOUNTS_PATH)
+                        _ACCOUNTS_PENDING = None
+                        _cache_accounts(parsed)
+            if current:
+                _mirror(ACCOUNTS_PATH, SHARE_ACCOUNTS)
+        except Exception as e:
+            _log("WARN", f"accounts flush failed: {e}")
+        finally:
+            tmp.unlink(missing_ok=True)
+
+def _accounts_flusher() -> None:
+    while True:
+        time.sleep(ACCOUNTS_FLUSH_INTERVAL)
+        flush_accounts()
+
+def _start_accounts_flusher() -> None:
+    global _ACCOUNTS_FLUSHER
+    if _ACCOUNTS_FLUSHER is not None and _ACCOUNTS_FLUSHER.is_alive():
+        return
+    _ACCOUNTS_FLUSHER = threading.Thread(target=_accounts_flusher, name="accounts-flusher", daemon=True)
+    _ACCOUNTS_FLUSHER.start()
+
+atexit.register(flush_accounts)
+
 def read_accounts() -> Dict[str, Dict[str, Union[str, float]]]:
+    """Return a private copy of the accounts (pending, cached, or parsed from disk)."""
+    global _ACCOUNTS_CACHE
+    with _ACCOUNTS_LOCK:
+        pending = _ACCOUNTS_PENDING
+        cached_stamp, cached = _ACCOUNTS_CACHE
+    if pending is not None:
+        return {k: dict(v) for k, v in pending.items()}
+    stamp = _accounts_stamp()
+    if stamp is None:
+        return {}
+    if stamp == cached_stamp:
+        return {k: dict(v) for k, v in cached.items()}
     accounts: Dict[str, Dict[str, Union[str, float]]] = {}
-    if not ACCOUNTS_PATH.exists():
-        return accounts
     with ACCOUNTS_PATH.open("r", encoding="utf-8", newline="") as f:
         r = csv.DictReader(f)
         for row in r:
@@ -319,22 +714,235 @@ def read_accounts() -> Dict[str, Dict[str, Union[str, float]]]:
             except Exception: bal = 0.0
             ltx = (row.get("last_transaction_utc") or "").strip()
             accounts[tenant] = {"name": name, "balance": bal, "last_transaction_utc": ltx}
-    return accounts
+    with _ACCOUNTS_LOCK:
+        _ACCOUNTS_CACHE = (stamp, accounts)
+    return {k: dict(v) for k, v in accounts.items()}
+
+def account_exists(tenant_code: str) -> bool:
+    """Membership test against the pending/cached accounts, without copying them."""
+    with _ACCOUNTS_LOCK:
+        pending = _ACCOUNTS_PENDING
+        cached_stamp, cached = _ACCOUNTS_CACHE
+    if pending is not None:
+        return tenant_code in pending
+    stamp = _accounts_stamp()
+    if stamp is None:
+        return False
+    if stamp == cached_stamp:
+        return tenant_code in cached
+    return tenant_code in read_accounts()  # re-parses and refreshes the cache
 
 def write_accounts(accounts: Dict[str, Dict[str, Union[str, float]]]) -> None:
+    """Rewrite accounts.csv atomically. Call under GLOBAL_LOCK.
+
+    Writers build `accounts` from read_accounts() under the same lock, so the
+    file written supersedes anything still staged for the flusher.
+    """
+    global _ACCOUNTS_PENDING
     tmp = ACCOUNTS_PATH.with_suffix(".csv.tmp")
-    with tmp.open("w", encoding="utf-8", newline="") as f:
-        w = csv.writer(f)
-        w.writerow(["tenant_code", "name", "balance", "last_transaction_utc"])
-        for tenant, rec in accounts.items():
-            name = rec.get("name", "")
-            bal = float(rec.get("balance", 0.0))
-            ltx = rec.get("last_transaction_utc", "")
-            w.writerow([tenant, name, _num_to_text(bal), ltx])
-        f.flush(); os.fsync(f.fileno())
+    parsed = _write_accounts_file(accounts, tmp)
     os.replace(tmp, ACCOUNTS_PATH)
+    with _ACCOUNTS_LOCK:
+        _ACCOUNTS_PENDING = None
+        _cache_accounts(parsed)
     _mirror(ACCOUNTS_PATH, SHARE_ACCOUNTS)
 
+def _row_to_bytes(fields) -> bytes:
+    """Encode one CSV row exactly as csv.writer would (QUOTE_MINIMAL, CRLF).
+
+    Ledger and accounts fields almost never need quoting, so the row is
+    joined directly; csv.writer is only used when a field contains a comma,
+    quote or line break.
+    """
+    vals = ["" if v is None else str(v) for v in fields]
+    line = ",".join(vals)
+    if line.count(",") == len(vals) - 1 and '"' not in line and "\n" not in line and "\r" not in line:
+        return (line + "\r\n").encode("utf-8")
+    buf = io.StringIO()
+    csv.writer(buf).writerow(vals)
+    return buf.getvalue().encode("utf-8")
+
+def _write_accounts_file(
+    accounts: Dict[str, Dict[str, Union[str, float]]], tmp: Path
+) -> Dict[str, Dict[str, Union[str, float]]]:
+    """Serialize accounts to `tmp` and fdatasync it.
+
+    Returns the accounts as read_accounts() would parse the written file back
+    (stripped fields, balances rounded by _num_to_text), for the cache.
+    """
+    parsed: Dict[str, Dict[str, Union[str, float]]] = {}
+    out = bytearray(_row_to_bytes(("tenant_code", "name", "balance", "last_transaction_utc")))
+    for tenant, rec in accounts.items():
+        name = rec.get("name", "")
+        bal_txt = _num_to_text(float(rec.get("balance", 0.0)))
+        ltx = rec.get("last_transaction_utc", "")
+        out += _row_to_bytes((tenant, name, bal_txt, ltx))
+        key = str(tenant).strip()
+        if key:
+            parsed[key] = {"name": str(name).strip(), "balance": float(bal_txt or 0),
+                           "last_transaction_utc": str(ltx or "").strip()}
+    with tmp.open("wb") as f:
+        f.write(out)
+        # Synced here, not batched: the data must be durable before the rename
+        f.flush(); os.fdatasync(f.fileno())
+    return parsed
+
+
+# transactions.csv is appended through one long-lived O_APPEND fd, one
+# os.write per row. The fd is reopened if the file was replaced (upload) or
+# removed.
+_TX_FD: Optional[int] = None
+_TX_FD_LOCK = threading.Lock()
+
+def _tx_fd() -> int:
+    """Return the append fd for TRANSACTIONS_PATH. Call with _TX_FD_LOCK held."""
+    global _TX_FD
+    if _TX_FD is not None:
+        try:
+            a, b = os.fstat(_TX_FD), os.stat(TRANSACTIONS_PATH)
+            if (a.st_dev, a.st_ino) == (b.st_dev, b.st_ino):
+                return _TX_FD
+        except FileNotFoundError:
+            # Removed behind our back: recreate it with its header
+            _FILES_READY.discard(TRANSACTIONS_PATH)
+            _ensure_file(TRANSACTIONS_PATH, TRANSACTIONS_HEADER)
+        except OSError:
+            pass
+        try:
+            os.close(_TX_FD)
+        except OSError:
+            pass
+        _TX_FD = None
+    _TX_FD = os.open(str(TRANSACTIONS_PATH), os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_CLOEXEC, 0o644)
+    return _TX_FD
+
+# The /share mirror of transactions.csv is updated off the request path. The
+# ledger only grows between uploads, so a copied mirror is extended with the
+# new tail (sendfile) rather than rewritten; anything unexpected falls back to
+# a full _mirror. Requests coalesce on one Event.
+_TX_MIRROR_STATE: Optional[Tuple[int, int, int]] = None  # (src ino, dst ino, bytes mirrored)
+_TX_MIRROR_EVENT = threading.Event()
+_TX_MIRROR_THREAD: Optional[threading.Thread] = None
+_TX_MIRROR_START_LOCK = threading.Lock()
+
+def _mirror_tx_now() -> None:
+    global _TX_MIRROR_STATE
+    try:
+        st = os.stat(TRANSACTIONS_PATH)
+        try:
+            dt = os.stat(SHARE_TX)
+        except FileNotFoundError:
+            dt = None
+        if (dt is not None and _TX_MIRROR_STATE == (st.st_ino, dt.st_ino, dt.st_size)
+                and st.st_size >= dt.st_size):
+            off = dt.st_size
+            if st.st_size > off:
+                # sendfile() rejects O_APPEND targets; write at the known offset
+                with open(TRANSACTIONS_PATH, "rb") as fs, open(SHARE_TX, "r+b") as fd:
+                    fd.seek(off)
+                    while off < st.st_size:
+                        n = os.sendfile(fd.fileno(), fs.fileno(), off, st.st_size - off)
+                        if n == 0:
+                            break
+                        off += n
+                _TX_MIRROR_STATE = (st.st_ino, dt.st_ino, off)
+            return
+        _mirror(TRANSACTIONS_PATH, SHARE_TX)
+        dt = os.stat(SHARE_TX)
+        _TX_MIRROR_STATE = (st.st_ino, dt.st_ino, dt.st_size)
+    except Exception as e:
+        _TX_MIRROR_STATE = None
+        _log("WARN", f"Mirror failed {TRANSACTIONS_PATH} -> {SHARE_TX}: {e}")
+
+def _tx_mirror_worker() -> None:
+    while True:
+        _TX_MIRROR_EVENT.wait()
+        _TX_MIRROR_EVENT.clear()
+        _mirror_tx_now()
+
+def _schedule_tx_mirror() -> None:
+    global _TX_MIRROR_THREAD
+    _TX_MIRROR_EVENT.set()
+    with _TX_MIRROR_START_LOCK:
+        if _TX_MIRROR_THREAD is None or not _TX_MIRROR_THREAD.is_alive():
+            _TX_MIRROR_THREAD = threading.Thread(target=_tx_mirror_worker, name="tx-mirror", daemon=True)
+            _TX_MIRROR_THREAD.start()
+
+atexit.register(_mirror_tx_now)
+
+# Group commit for transactions.csv: append_transaction() queues the encoded
+# row. The writer appends everything queued with one os.write and one
+# fdatasync once TX_BATCH_ROWS rows are waiting or TX_FLUSH_INTERVAL seconds
+# after the first. Rows that record a debit are appended with durable=True and
+# only return once a flush has synced them (whoever holds _TX_FD_LOCK syncs
+# everyone's rows). Anything that reads the ledger calls flush_transactions()
+# first, so queued rows are never missing from /history or downloads.
+TX_FLUSH_INTERVAL = 0.25
+TX_BATCH_ROWS = 16
+TX_PENDING_MAX = 1024  # past this, append_transaction() flushes inline
+_TX_PENDING: List[bytes] = []
+_TX_COND = threading.Condition()
+_TX_WRITER: Optional[threading.Thread] = None
+_TX_SYNC_NEEDED = False  # bytes are in the file but their fdatasync failed
+
+def flush_transactions() -> bool:
+    """Append and sync all queued transaction rows, in order.
+
+    Returns True when every row queued before the call is durable. On a
+    failed write only the unwritten bytes are re-queued; after a failed sync
+    nothing is re-appended and only the sync is retried next time.
+    """
+    global _TX_SYNC_NEEDED
+    with _TX_FD_LOCK:  # also orders concurrent flushers
+        with _TX_COND:
+            rows = _TX_PENDING[:]
+            del _TX_PENDING[:]
+        if not rows and not _TX_SYNC_NEEDED:
+            return True
+        data = memoryview(b"".join(rows))
+        try:
+            if rows:
+                _ensure_file(TRANSACTIONS_PATH, TRANSACTIONS_HEADER)
+            fd = _tx_fd()
+            while data:
+                data = data[os.write(fd, data):]
+            _TX_SYNC_NEEDED = True
+            os.fdatasync(fd)
+            _TX_SYNC_NEEDED = False
+        except OSError as e:
+            if data:
+                # Keep the unwritten tail queued ahead of newer rows
+                with _TX_COND:
+                    _TX_PENDING.insert(0, bytes(data))
+            _log("WARN", f"transactions flush failed: {e}")
+            return False
+    if rows:
+        _schedule_tx_mirror()
+    return True
+
+def _tx_writer() -> None:
+    while True:
+        with _TX_COND:
+            while not _TX_PENDING and not _TX_SYNC_NEEDED:
+                _TX_COND.wait()
+            deadline = time.monotonic() + TX_FLUSH_INTERVAL
+            while len(_TX_PENDING) < TX_BATCH_ROWS:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                _TX_COND.wait(left)
+        if not flush_transactions():
+            time.sleep(TX_FLUSH_INTERVAL)  # don't spin on a failing disk
+
+def _start_tx_writer() -> None:
+    global _TX_WRITER
+    with _TX_COND:
+        if _TX_WRITER is not None and _TX_WRITER.is_alive():
+            return
+        _TX_WRITER = threading.Thread(target=_tx_writer, name="tx-writer", daemon=True)
+        _TX_WRITER.start()
+
+atexit.register(flush_transactions)
 
 def append_transaction(
     tenant_code: str,
@@ -343,8 +951,11 @@ def append_transaction(
     balance_before: float,
     balance_after: float,
     cycle_minutes: Optional[int],
-    success: Union[bool, str, int]
+    success: Union[bool, str, int],
+    durable: bool = False
 ) -> None:
+    """Queue a ledger row. With durable=True, return only once it is synced
+    (raises OSError if it could not be); use it for rows that record a debit."""
     ts = datetime.now(timezone.utc).isoformat()
     success_txt = "True" if (success is True or str(success).lower() in {"true","1","ok","success","yes"}) else "False"
     row = [
@@ -356,38 +967,154 @@ def append_transaction(
         str(cycle_minutes) if cycle_minutes is not None else "",
         success_txt,
     ]
-    _ensure_file(TRANSACTIONS_PATH, TRANSACTIONS_HEADER)
-    with TRANSACTIONS_PATH.open("a", encoding="utf-8", newline="") as f:
-        w = csv.writer(f); w.writerow(row); f.flush(); os.fsync(f.fileno())
-
-    _mirror(TRANSACTIONS_PATH, SHARE_TX)
+    line = _row_to_bytes(row)
+    with _TX_COND:
+        _TX_PENDING.append(line)
+        backlog = len(_TX_PENDING)
+        _TX_COND.notify()
+    _start_tx_writer()
+    if durable or backlog >= TX_PENDING_MAX:
+        if not flush_transactions() and durable:
+            raise OSError("transaction row not synced")
 
     _log("INFO", f"TX appended: {row}")
 
 
-def tail_transactions(n: int = 50) -> List[Dict[str, str]]:
-    if not TRANSACTIONS_PATH.exists():
+TAIL_BLOCK = 8192
+_TX_COLS = tuple(TRANSACTIONS_HEADER.rstrip("\n").split(","))
+# Fields returned by /history, and their column positions in the standard header
+_TX_ITEM_KEYS = ("timestamp", "tenant_code", "machine_number", "amount_charged",
+                 "balance_after", "cycle_minutes", "success")
+_TX_ITEM_POS = tuple(_TX_COLS.index(k) for k in _TX_ITEM_KEYS)
+_TX_HEADER: Optional[Tuple[Tuple[int, int], Tuple[int, ...]]] = None  # ((dev, ino), positions)
+
+def _tx_header(f, st: os.stat_result) -> Tuple[int, ...]:
+    """Column positions of _TX_ITEM_KEYS in transactions.csv (-1 = absent).
+
+    The header is read once per inode. Files written by the app use the
+    standard layout; uploaded ones may order or name columns differently.
+    """
+    global _TX_HEADER
+    key = (st.st_dev, st.st_ino)
+    cached = _TX_HEADER
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    f.seek(0)
+    cols = tuple(next(csv.reader([f.readline().decode("utf-8-sig", "replace")]), []))
+    if cols == _TX_COLS:
+        pos = _TX_ITEM_POS
+    else:
+        pos = tuple(cols.index(k) if k in cols else -1 for k in _TX_ITEM_KEYS)
+    _TX_HEADER = (key, pos)
+    return pos
+
+def _tx_lines_newest_first(f, size: int) -> Iterator[bytes]:
+    """Yield the non-blank data lines of transactions.csv, newest first.
+
+    Reads backwards in TAIL_BLOCK chunks, carrying the partial first line of
+    each block into the next; the header (first line of the file) is skipped.
+    """
+    pos = size
+    carry = b""
+    while pos > 0:
+        step = min(TAIL_BLOCK, pos)
+        pos -= step
+        f.seek(pos)
+        lines = (f.read(step) + carry).split(b"\n")
+        carry = lines[0]
+        for ln in reversed(lines[1:]):
+            if ln.strip():
+                yield ln
+
+def _tx_rows(pos: Tuple[int, ...], lines) -> Iterator[Dict[str, str]]:
+    for vals in csv.reader(ln.decode("utf-8", "replace") for ln in lines):
+        n = len(vals)
+        yield {k: (vals[i] if -1 < i < n else "") for k, i in zip(_TX_ITEM_KEYS, pos)}
+
+def tail_transactions(n: int = 50, offset: int = 0) -> List[Dict[str, str]]:
+    """Return up to n rows (oldest first), skipping the newest `offset` rows.
+
+    Reads backwards from the end of the file, so the cost depends on n, not
+    on the ledger size.
+    """
+    if n <= 0:
         return []
-    with TRANSACTIONS_PATH.open("r", encoding="utf-8", newline="") as f:
-        reader = csv.DictReader(f)
-        # Keep only the last n rows in memory, streaming through the file
-        rows = deque(reader, maxlen=n)
-    out: List[Dict[str, str]] = []
-    for row in rows:
-        out.append({
-            "timestamp": row.get("timestamp", ""),
-            "tenant_code": row.get("tenant_code", ""),
-            "machine_number": row.get("machine_number", ""),
-            "amount_charged": row.get("amount_charged", ""),
-            "balance_after": row.get("balance_after", ""),
-            "cycle_minutes": row.get("cycle_minutes", ""),
-            "success": row.get("success", ""),
-        })
-    return out
+    flush_transactions()
+    try:
+        f = TRANSACTIONS_PATH.open("rb")
+    except FileNotFoundError:
+        return []
+    with f:
+        st = os.fstat(f.fileno())
+        pos = _tx_header(f, st)
+        lines = list(itertools.islice(_tx_lines_newest_first(f, st.st_size), offset, offset + n))
+    lines.reverse()
+    return list(_tx_rows(pos, lines))
+
+def stream_transactions(limit: int = 0, offset: int = 0) -> Iterator[bytes]:
+    """Yield transactions newest first as NDJSON (limit 0 = all), in ~64 KiB chunks.
+
+    Rows go straight from the backwards scan to the client; nothing is
+    collected, so memory does not grow with `limit`.
+    """
+    flush_transactions()
+    try:
+        f = TRANSACTIONS_PATH.open("rb")
+    except FileNotFoundError:
+        return
+    with f:
+        st = os.fstat(f.fileno())
+        pos = _tx_header(f, st)
+        lines = itertools.islice(
+            _tx_lines_newest_first(f, st.st_size), offset, offset + limit if limit else None
+        )
+        buf = bytearray()
+        for item in _tx_rows(pos, lines):
+            buf += _json_dumps(item)
+            buf += b"\n"
+            if len(buf) >= 65536:
+                yield bytes(buf)
+                buf.clear()
+        if buf:
+            yield bytes(buf)
 
 
 # ----------------------- TTS -----------------------------
+# Announcements run on one background worker: callers never wait on HA, and a
+# single worker keeps them in the order they were queued. The queue is
+# bounded so a mashed keypad cannot pile up a minute of stale prompts;
+# anything beyond TTS_QUEUE_MAX is dropped.
+TTS_QUEUE_MAX = 8
+_TTS_QUEUE: "queue.Queue[str]" = queue.Queue(maxsize=TTS_QUEUE_MAX)
+_TTS_WORKER: Optional[threading.Thread] = None
+_TTS_START_LOCK = threading.Lock()
+
+def _tts_worker() -> None:
+    while True:
+        text = _TTS_QUEUE.get()
+        try:
+            _speak_impl(text)
+        except Exception as e:
+            _log("WARN", f"TTS worker error: {e}")
+
+def start_tts_worker() -> None:
+    global _TTS_WORKER
+    with _TTS_START_LOCK:
+        if _TTS_WORKER is None or not _TTS_WORKER.is_alive():
+            _TTS_WORKER = threading.Thread(target=_tts_worker, name="tts", daemon=True)
+            _TTS_WORKER.start()
+
 def speak(text: str):
+    """Queue `text` for announcement and return immediately."""
+    if not text:
+        return
+    start_tts_worker()
+    try:
+        _TTS_QUEUE.put_nowait(text)
+    except queue.Full:
+        _log("WARN", f"TTS queue full; dropped: {text}")
+
+def _speak_impl(text: str):
     """Use HA tts.speak with the new schema; fall back to legacy service if needed."""
     if not text:
         return
@@ -451,6 +1178,55 @@ def _adam_cfg(opts: dict) -> dict:
         "invert_di": bool(opts.get("invert_di", False)),
     }
 
+# One persistent Modbus/TCP connection to the ADAM, shared by all DI/DO I/O.
+# It is rebuilt when host/port change and dropped after any failed request;
+# _adam_call then retries once on a fresh connection.
+_ADAM_CLIENT = None
+_ADAM_KEY: Optional[Tuple[str, int]] = None
+_ADAM_LOCK = threading.Lock()
+
+def _adam_drop() -> None:
+    global _ADAM_CLIENT, _ADAM_KEY
+    if _ADAM_CLIENT is not None:
+        try:
+            _ADAM_CLIENT.close()
+        except Exception:
+            pass
+    _ADAM_CLIENT = None
+    _ADAM_KEY = None
+
+def _adam_call(host: str, port: int, op: Callable, what: str):
+    """Run op(client) on the shared client under _ADAM_LOCK; response or None.
+
+    The ADAM closes idle connections on its own, and a socket it already
+    closed still looks open here, so the first request after an idle spell
+    fails (exception, or an isError()/ModbusIOException response). Any
+    failure drops the client, and the request is repeated once on a fresh
+    connection before giving up.
+    """
+    global _ADAM_CLIENT, _ADAM_KEY
+    with _ADAM_LOCK:
+        if _ADAM_CLIENT is not None and _ADAM_KEY != (host, port):
+            _adam_drop()
+        for attempt in (1, 2):
+            if _ADAM_CLIENT is None:
+                _ADAM_CLIENT = ModbusTcpClient(host=host, port=port, timeout=2.0)  # type: ignore
+                _ADAM_KEY = (host, port)
+            client = _ADAM_CLIENT
+            try:
+                if not (client.is_socket_open() or client.connect()):
+                    reason = "connect failed"
+                else:
+                    rr = op(client)
+                    if hasattr(rr, "isError") and not rr.isError():
+                        return rr
+                    reason = f"error response: {rr}"
+            except Exception as e:
+                reason = f"exception: {e}"
+            _adam_drop()
+            _log("WARN", f"ADAM: {what} {reason}" + (" (reconnecting)" if attempt == 1 else ""))
+        return None
+
 def _adam_read_di(di_index: int, opts: dict) -> Optional[bool]:
     """Return True if DI is active; None on error. Uses invert_di if set."""
     if not _HAS_PYMODBUS:
@@ -459,25 +1235,44 @@ def _adam_read_di(di_index: int, opts: dict) -> Optional[bool]:
     host = (cfg["host"] or "").strip()
     if not host:
         return None
-    try:
-        with ModbusTcpClient(host=host, port=cfg["port"], timeout=2.0) as client:  # type: ignore
-            if not client.connect():
-                _log("WARN", "ADAM: connect failed for DI read")
-                return None
-            rr = client.read_discrete_inputs(address=int(di_index), count=1, unit=cfg["unit"])
-            if not hasattr(rr, "isError") or rr.isError():
-                _log("WARN", "ADAM: read_discrete_inputs error")
-                return None
-            bits = getattr(rr, "bits", [False])
-            raw = bool(bits[0] if bits else False)
-            return (not raw) if cfg["invert_di"] else raw
-    except Exception as e:
-        _log("WARN", f"ADAM: DI read exception: {e}")
+    rr = _adam_call(host, cfg["port"],
+                    lambda c: c.read_discrete_inputs(address=int(di_index), count=1, unit=cfg["unit"]),
+                    "read_discrete_inputs")
+    if rr is None:
         return None
+    bits = getattr(rr, "bits", [False])
+    raw = bool(bits[0] if bits else False)
+    return (not raw) if cfg["invert_di"] else raw
+
+def _adam_read_dis(di_indexes: List[int], opts: dict) -> Dict[int, Optional[bool]]:
+    """Read several DIs with one read_discrete_inputs over their span.
+
+    Same semantics as _adam_read_di per index (invert_di applied, None on error).
+    """
+    out: Dict[int, Optional[bool]] = dict.fromkeys(di_indexes)
+    if not di_indexes or not _HAS_PYMODBUS:
+        return out
+    cfg = _adam_cfg(opts)
+    host = (cfg["host"] or "").strip()
+    if not host:
+        return out
+    lo, hi = min(di_indexes), max(di_indexes)
+    rr = _adam_call(host, cfg["port"],
+                    lambda c: c.read_discrete_inputs(address=lo, count=hi - lo + 1, unit=cfg["unit"]),
+                    "read_discrete_inputs")
+    if rr is None:
+        return out
+    bits = getattr(rr, "bits", None) or []
+    for di in out:
+        if di - lo < len(bits):
+            raw = bool(bits[di - lo])
+            out[di] = (not raw) if cfg["invert_di"] else raw
+    return out
 
 def _adam_write_coil(coil_index: int, state: bool, opts: dict) -> bool:
     """
     Write ADAM DO coil. ADAM-6050 maps DO0..5 to coils 16..21, so we add ADAM_COIL_BASE.
+    Setting a coil is idempotent, so the reconnect retry in _adam_call is safe.
     """
     if not _HAS_PYMODBUS:
         return False
@@ -487,18 +1282,13 @@ def _adam_write_coil(coil_index: int, state: bool, opts: dict) -> bool:
         return False
     try:
         addr = ADAM_COIL_BASE + int(coil_index)
-        with ModbusTcpClient(host=host, port=cfg["port"], timeout=2.0) as client:  # type: ignore
-            if not client.connect():
-                _log("WARN", "ADAM: connect failed for write_coil")
-                return False
-            wr = client.write_coil(addr, bool(state), unit=cfg["unit"])
-            if not hasattr(wr, "isError") or wr.isError():
-                _log("WARN", f"ADAM: write_coil error at addr={addr}")
-                return False
-            return True
-    except Exception as e:
-        _log("WARN", f"ADAM: write_coil exception: {e}")
+    except (TypeError, ValueError):
+        _log("WARN", f"ADAM: bad coil index {coil_index!r}")
         return False
+    wr = _adam_call(host, cfg["port"],
+                    lambda c: c.write_coil(addr, bool(state), unit=cfg["unit"]),
+                    f"write_coil addr={addr}")
+    return wr is not None
 
 def _adam_pulse(coil_index: int, pulse_seconds: float, opts: dict) -> bool:
     """
@@ -535,18 +1325,61 @@ def machine_enabled(mid: str, opts: dict) -> bool:
     except Exception:
         pass
 
-    for m in (opts.get("machines") or []):
-        if str(m.get("id")) == str(mid):
-            if _is_false(m.get("enabled", True)):
-                return False
-            break
+    idx = _opts_index(opts)
+    m = idx["machines"].get(str(mid))
+    if m is not None and _is_false(m.get("enabled", True)):
+        return False
 
-    dm = [str(x) for x in (opts.get("disabled_machines") or [])]
-    if str(mid) in dm:
+    if str(mid) in idx["disabled"]:
         return False
 
     return True
 
+# Sorted machine ids and the washing-id set, memoized per options.json version
+_MACHINE_IDS: Tuple[Optional[Tuple[int, int]], Tuple[List[str], frozenset]] = (None, ([], frozenset()))
+
+def _machine_ids(opts: dict) -> Tuple[List[str], frozenset]:
+    """Return (all ids sorted numerically, washing ids) for /machines."""
+    global _MACHINE_IDS
+    stamp, cached_opts = _OPTIONS_CACHE
+    cacheable = opts is cached_opts and stamp is not None
+    if cacheable and _MACHINE_IDS[0] == stamp:
+        return _MACHINE_IDS[1]
+    wm = [str(x) for x in (opts.get("washing_machines") or [1, 2, 3])]
+    dm = [str(x) for x in (opts.get("dryer_machines") or [4, 5, 6])]
+    val = (sorted(wm + dm, key=int), frozenset(wm))
+    if cacheable:
+        _MACHINE_IDS = (stamp, val)
+    return val
+
+# Per-machine values derived purely from options, memoized per options.json
+# version. Only the shared dict returned by _read_options() is cached; any
+# other opts dict is computed fresh.
+_MACHINE_INFO: Dict[Tuple[str, Tuple[int, int]], tuple] = {}
+
+def _machine_info(mid: str, opts: dict) -> Tuple[str, str, float, int, bool, Optional[int]]:
+    """Return (ha_switch, ha_sensor, price, default_minutes, enabled, di_index)."""
+    stamp, cached_opts = _OPTIONS_CACHE
+    key = (mid, stamp) if opts is cached_opts and stamp is not None else None
+    if key is not None:
+        hit = _MACHINE_INFO.get(key)
+        if hit is not None:
+            return hit
+    switch, sensor = _machine_entities(mid, opts)
+    info = (
+        switch,
+        sensor,
+        _price_for(mid, opts),
+        _default_minutes_for(mid, opts),
+        machine_enabled(mid, opts),
+        _machine_adam_mapping(mid, opts)[1],
+    )
+    if key is not None:
+        if len(_MACHINE_INFO) > 256:  # stale versions pile up across config saves
+            _MACHINE_INFO.clear()
+        _MACHINE_INFO[key] = info
+    return info
+
 def machine_is_available(mid: str, opts: dict) -> bool:
     """Check machine real availability (independent of simulate).
     Priority:
@@ -652,6 +1485,85 @@ def _check_and_commit_idempotency(key: str, opts: dict) -> None:
 
 
 
+# Confirmation polling: short first delays so a device that flips right after
+# activation is seen within tens of ms, then settle at CONFIRM_MAX_DELAY.
+CONFIRM_BACKOFF = (0.02, 0.05, 0.1, 0.2, 0.4)
+CONFIRM_MAX_DELAY = 0.5
+
+# Deferred turn-offs: one heap ordered by monotonic due time and a single
+# worker thread, instead of one threading.Timer thread per activation.
+_TIMERS: List[Tuple[float, int, object]] = []
+_TIMERS_COND = threading.Condition()
+_TIMERS_SEQ = itertools.count()
+_TIMER_THREAD: Optional[threading.Thread] = None
+
+def _timer_worker() -> None:
+    while True:
+        with _TIMERS_COND:
+            while True:
+                if not _TIMERS:
+                    _TIMERS_COND.wait()
+                    continue
+                wait = _TIMERS[0][0] - time.monotonic()
+                if wait <= 0:
+                    _, _, fn = heapq.heappop(_TIMERS)
+                    break
+                _TIMERS_COND.wait(wait)
+        try:
+            fn()
+        except Exception as e:
+            _log("WARN", f"scheduled task failed: {e}")
+
+def _schedule_after(delay: float, fn) -> None:
+    """Run fn() on the timer thread after `delay` seconds."""
+    global _TIMER_THREAD
+    with _TIMERS_COND:
+        heapq.heappush(_TIMERS, (time.monotonic() + delay, next(_TIMERS_SEQ), fn))
+        _TIMERS_COND.notify()
+        if _TIMER_THREAD is None or not _TIMER_THREAD.is_alive():
+            _TIMER_THREAD = threading.Thread(target=_timer_worker, name="timers", daemon=True)
+            _TIMER_THREAD.start()
+
+def _poll_until(probe, timeout: float) -> bool:
+    """Call probe() with geometric backoff until it returns True or timeout elapses."""
+    t0 = time.monotonic()
+    i = 0
+    while True:
+        if probe():
+            return True
+        remaining = timeout - (time.monotonic() - t0)
+        if remaining <= 0:
+            return False
+        delay = CONFIRM_BACKOFF[i] if i < len(CONFIRM_BACKOFF) else CONFIRM_MAX_DELAY
+        i += 1
+        time.sleep(min(delay, remaining))
+
+def _confirm_running(sensor: str, opts: dict, timeout: float) -> bool:
+    """Wait until `sensor` reports running.
+
+    Uses the state_changed watcher when its socket is live (wakes on the
+    event), otherwise polls REST. One REST read comes first, so a state that
+    changed before the watcher saw the entity still counts.
+    """
+    probe = lambda: _get_state(sensor, opts) in _RUNNING_STATES
+    if not _HA_STATES_LIVE:
+        return _poll_until(probe, timeout)
+    t0 = time.monotonic()
+    if probe():
+        return True
+    with _HA_STATES_COND:
+        _HA_STATES_COND.wait_for(
+            lambda: _HA_STATES.get(sensor) in _RUNNING_STATES or not _HA_STATES_LIVE,
+            max(0.0, timeout - (time.monotonic() - t0)),
+        )
+        if _HA_STATES.get(sensor) in _RUNNING_STATES:
+            return True
+        live = _HA_STATES_LIVE
+    remaining = timeout - (time.monotonic() - t0)
+    if live or remaining <= 0:
+        return False
+    return _poll_until(probe, remaining)  # watcher dropped mid-wait
+
 def operate_machine(mid: str, minutes: Optional[int]) -> dict:
     opts = _read_options()
     simulate = bool(opts.get("simulate", False))
@@ -684,21 +1596,12 @@ def operate_machine(mid: str, minutes: Optional[int]) -> dict:
             _log("WARN", f"ADAM: failed to activate relay for machine {mid}")
             return {"ok": False, "confirmed": False}
 
-        t0 = time.monotonic()
-        confirmed = False
-        while time.monotonic() - t0 < confirm_timeout:
-            if di is not None:
-                di_state = _adam_read_di(di, opts)  # True => RUNNING
-                if di_state is True:
-                    confirmed = True
-                    break
-            else:
-                if token:
-                    st = _get_state(sensor, opts)
-                    if st in ("on", "true", "1", "running"):
-                        confirmed = True
-                        break
-            time.sleep(0.5)
+        if di is not None:
+            confirmed = _poll_until(lambda: _adam_read_di(di, opts) is True, confirm_timeout)  # True => RUNNING
+        elif token:
+            confirmed = _confirm_running(sensor, opts, confirm_timeout)
+        else:
+            confirmed = False
 
         if not confirmed:
             _log("WARN", f"Activation not confirmed (ADAM). mid={mid} di={di} sensor={sensor}")
@@ -713,9 +1616,7 @@ def operate_machine(mid: str, minutes: Optional[int]) -> dict:
                     _adam_write_coil(r, False, opts)
                 except Exception as e:
                     _log("WARN", f"ADAM: failed to turn OFF relay for m#{mid}: {e}")
-            t = threading.Timer(minutes * 60.0, turn_off_later)
-            t.daemon = True
-            t.start()
+            _schedule_after(minutes * 60.0, turn_off_later)
 
         return {"ok": True, "confirmed": True}
 
@@ -731,14 +1632,7 @@ def operate_machine(mid: str, minutes: Optional[int]) -> dict:
         _log("WARN", f"Failed to turn ON {switch}: {e}")
         return {"ok": False, "confirmed": False}
 
-    t0 = time.monotonic()
-    confirmed = False
-    while time.monotonic() - t0 < confirm_timeout:
-        st = _get_state(sensor, opts)
-        if st in ("on", "true", "1", "running"):
-            confirmed = True
-            break
-        time.sleep(0.5)
+    confirmed = _confirm_running(sensor, opts, confirm_timeout)
 
     if not confirmed:
         _log("WARN", f"Activation not confirmed by {sensor}")
@@ -755,9 +1649,7 @@ def operate_machine(mid: str, minutes: Optional[int]) -> dict:
                 _ha_call_service(url, token, "switch", "turn_off", {"entity_id": switch})
             except Exception as e:
                 _log("WARN", f"Failed to turn OFF {switch}: {e}")
-        t = threading.Timer(minutes * 60.0, turn_off_later)
-        t.daemon = True
-        t.start()
+        _schedule_after(minutes * 60.0, turn_off_later)
 
     return {"ok": True, "confirmed": True}
 
@@ -850,11 +1742,12 @@ def _handle_charge(tenant_code: str, machine: str, price: Optional[float], minut
         ok = bool(activated and activated.get("ok"))
 
         # If real activation failed (not simulate), record failure and abort
+        # No GLOBAL_LOCK needed: read_accounts() is a consistent copy and the
+        # failure row is a single atomic append
         if not ok and not simulate:
-            with file_lock(GLOBAL_LOCK, timeout=10.0):
-                accounts = read_accounts()
-                bal0 = float(accounts.get(tenant_code, {}).get("balance", 0.0))
-                append_transaction(tenant_code, machine, 0.0, bal0, bal0, m, success=False)
+            accounts = read_accounts()
+            bal0 = float(accounts.get(tenant_code, {}).get("balance", 0.0))
+            append_transaction(tenant_code, machine, 0.0, bal0, bal0, m, success=False)
             raise HTTPException(status_code=500, detail="ACTIVATION_FAILED")
 
         # Schedule soft-busy window (prevents immediate retrigger)
@@ -866,22 +1759,7 @@ def _handle_charge(tenant_code: str, machine: str, price: Optional[float], minut
                 LAST_TRIGGER_AT[str(machine)] = time.time()
             except Exception:
                 pass
-
-            mode = str(opts.get("do_mode") or "pulse").lower()
-            adam_enabled = bool((opts.get("adam_host") or "").strip())
-
-            # Only schedule HA-based auto-release for HA path (not ADAM hold)
-            if mode == "hold" and not adam_enabled:
-                def _auto_release():
-                    try:
-                        url = opts.get("ha_url") or "http://supervisor/core"
-                        token = _resolve_token(opts.get("ha_token"))
-                        switch, _sensor = _machine_entities(machine, opts)
-                        if token and switch:
-                            _ha_call_service(url, token, "switch", "turn_off", {"entity_id": switch})
-                    except Exception:
-                        pass
-                threading.Timer(duration_s, _auto_release).start()
+            # Turn-off after the cycle is scheduled by operate_machine
 
         # Balance adjustment + transaction under global lock
         with file_lock(GLOBAL_LOCK, timeout=10.0):
@@ -917,13 +1795,17 @@ def _handle_charge(tenant_code: str, machine: str, price: Optional[float], minut
 
             bal_after = bal_before - p
             accounts[tenant_code]["balance"] = bal_after
-            accounts[tenant_code]["last_transaction_utc"] = datetime.now(timezone.utc).isoformat()
+            accounts[tenant_code]["last_transaction_utc"] = _iso_now()
 
             # Success is ONLY when real confirmation AND not simulate
             success_ok = bool(ok and (not simulate))
-            append_transaction(tenant_code, machine, p, bal_before, bal_after, m, success=success_ok)
+            append_transaction(tenant_code, machine, p, bal_before, bal_after, m, success=success_ok,
+                               durable=True)
 
-            write_accounts(accounts)
+            # The ledger row above is synced before the lock is released; the
+            # balance goes through the write-behind flusher, which coalesces
+            # back-to-back charges into one accounts.csv rewrite
+            _stage_accounts(accounts)
 
     if ok or simulate:
         speak(f"Machine {machine} started.")
@@ -941,6 +1823,15 @@ def _handle_charge(tenant_code: str, machine: str, price: Optional[float], minut
 
 # ----------------------- Keypad (EVDEV + HA WS) ----------
 # Minimal state machine: 6-digit code, then machine 1..6, then confirm
+_IS_DIGIT = frozenset("0123456789")  # syms are single ASCII chars from our keymaps
+# charge failures spoken on the keypad; anything else falls back to the detail code
+_HTTP_STATUS_SPEECH: Dict[int, str] = {
+    409: "Machine is busy.",
+    402: "Insufficient balance.",
+    423: "Machine disabled.",
+    404: "User not found.",
+}
+
 class KeypadStateMachine:
     """
     Flow:
@@ -975,21 +1866,20 @@ class KeypadStateMachine:
             return
 
         if self.state == "IDLE":
-            if sym.isdigit():
+            if sym in _IS_DIGIT:
                 self.state = "ENTER_CODE"
                 self.buf_code = sym
                 self.speak("Enter your 6 digit code.")
             return
 
         if self.state == "ENTER_CODE":
-            if sym.isdigit():
+            if sym in _IS_DIGIT:
                 if len(self.buf_code) < 6:
                     self.buf_code += sym
                 return
             if sym == "ENTER":
                 if len(self.buf_code) == 6:
-                    accounts = read_accounts()
-                    if self.buf_code not in accounts:
+                    if not account_exists(self.buf_code):
                         self.speak("Invalid code.")
                         self._reset()
                         return
@@ -1000,11 +1890,10 @@ class KeypadStateMachine:
             return
 
         if self.state == "SELECT_MACHINE":
-            if sym.isdigit():
+            if sym in _IS_DIGIT:
                 n = int(sym)
                 if 1 <= n <= 6:
                     self.sel_machine = n
-                    mins = _default_minutes_for(str(n), self.opts_provider())
                     self.speak(f"Machine {n} selected. Press enter to confirm.")
                     self.state = "CONFIRM"
             return
@@ -1021,16 +1910,7 @@ class KeypadStateMachine:
                     )
                     self.speak("Payment accepted. Starting the cycle.")
                 except HTTPException as e:
-                    msg = str(e.detail)
-                    if e.status_code == 409:
-                        msg = "Machine is busy."
-                    elif e.status_code == 402:
-                        msg = "Insufficient balance."
-                    elif e.status_code == 423:
-                        msg = "Machine disabled."
-                    elif e.status_code == 404:
-                        msg = "User not found."
-                    self.speak(msg)
+                    self.speak(_HTTP_STATUS_SPEECH.get(e.status_code) or str(e.detail))
                 except Exception:
                     self.speak("Operation failed.")
                 finally:
@@ -1048,54 +1928,50 @@ class KeypadStateMachine:
 _MAIN_ROW_NUM = {2: "1", 3: "2", 4: "3", 5: "4", 6: "5", 7: "6", 8: "7", 9: "8", 10: "9", 11: "0"}  # KEY_1..KEY_0
 _KP_NUM       = {79: "1", 80: "2", 81: "3", 75: "4", 76: "5", 77: "6", 71: "7", 72: "8", 73: "9", 82: "0"}  # KP1..KP0
 
-def _map_keycode_name(name: str) -> Optional[str]:
-    """
-    Evdev isimlerine göre mapping:
-      - Num/Caps/Scroll lock'ları yut (None)
-      - ENTER/KPENTER/HASHTAG -> "ENTER"
-      - ESC/BACKSPACE/DELETE/DEL/TAB/INS -> "CANCEL"
-      - HOME/UP/PAGEUP/LEFT/RIGHT/END/DOWN/PAGEDOWN/INSERT -> 7/8/9/4/6/1/2/3/0 (NumLock kapalı varyant)
-      - KP0..KP9 -> "0".."9", üst sıra rakamlar -> "0".."9"
-    """
-    if not name:
-        return None
-    k = name
-    if k.startswith("KEY_"):
-        k = k[4:]
-
-    # Kilit tuşlarını tamamen yut
-    if k in ("NUMLOCK", "CAPSLOCK", "SCROLLLOCK", "NUM_LOCK", "CAPS_LOCK", "SCROLL_LOCK"):
-        return None
-
-    if k in ("ENTER", "KPENTER", "HASHTAG"):
-        return "ENTER"
+# NAV → rakam (NumLock kapalı varyantları); 111 (DELETE) -> CANCEL
+_NAV_NUM = {102: "7", 103: "8", 104: "9", 105: "4", 106: "6", 107: "1", 108: "2", 109: "3", 110: "0"}
+# Single table for _map_keycode_int: one dict lookup per key event
+_KEYCODE_TO_SYM: Dict[int, str] = {
+    **_NAV_NUM, **_MAIN_ROW_NUM, **_KP_NUM,
+    28: "ENTER", 96: "ENTER",   # Enter, KP_Enter
+    43: "ENTER",                # '#'
+    1: "CANCEL", 14: "CANCEL", 111: "CANCEL", 15: "CANCEL",  # Esc, Backspace, Delete, Tab
+}
 
-    # İptal tuşları
-    if k in ("KPASTERISK", "ESC", "BACKSPACE", "DELETE", "DEL", "TAB", "INS"):
-        return "CANCEL"
+_ENTER_NAMES = frozenset(("ENTER", "KPENTER", "HASHTAG"))
+# İptal tuşları
+_CANCEL_NAMES = frozenset(("KPASTERISK", "ESC", "BACKSPACE", "DELETE", "DEL", "TAB", "INS"))
 
+def _build_keyname_table() -> Dict[str, str]:
+    """Every evdev key name _map_keycode_name understands, with and without KEY_."""
+    table: Dict[str, str] = dict.fromkeys(_ENTER_NAMES, "ENTER")
+    table.update(dict.fromkeys(_CANCEL_NAMES, "CANCEL"))
     # NumLock kapalı iken gelen NAV -> rakam zorlaması
-    nav_map = {
+    table.update({
         "HOME": "7", "UP": "8", "PAGEUP": "9",
         "LEFT": "4",              "RIGHT": "6",
         "END":  "1", "DOWN": "2", "PAGEDOWN": "3",
         "INSERT": "0",
-    }
-    if k in nav_map:
-        return nav_map[k]
+    })
+    for d in "0123456789":
+        table["KP" + d] = d  # KP0..KP9
+        table[d] = d         # Üst sıra rakamları
+    # Kilit ve F tuşları tabloda yok -> None (yut)
+    table.update({"KEY_" + k: v for k, v in list(table.items())})
+    return table
 
-    # KP0..KP9
-    if k.startswith("KP") and len(k) == 3 and k[2].isdigit():
-        return k[2]
+_KEYNAME_TO_SYM = _build_keyname_table()
 
-    # Üst sıra rakamları
-    if len(k) == 1 and k.isdigit():
-        return k
-
-    # F tuşları vs. yut
-    if len(k) == 2 and k[0] == "F" and k[1].isdigit():
-        return None
-    return None
+def _map_keycode_name(name: str) -> Optional[str]:
+    """
+    Evdev isimlerine göre mapping:
+      - Num/Caps/Scroll lock'ları yut (None)
+      - ENTER/KPENTER/HASHTAG -> "ENTER"
+      - ESC/BACKSPACE/DELETE/DEL/TAB/INS -> "CANCEL"
+      - HOME/UP/PAGEUP/LEFT/RIGHT/END/DOWN/PAGEDOWN/INSERT -> 7/8/9/4/6/1/2/3/0 (NumLock kapalı varyant)
+      - KP0..KP9 -> "0".."9", üst sıra rakamlar -> "0".."9"
+    """
+    return _KEYNAME_TO_SYM.get(name) if name else None
 
 
 def _map_keycode_int(code: int) -> Optional[str]:
@@ -1108,52 +1984,60 @@ def _map_keycode_int(code: int) -> Optional[str]:
       - Esc/Backspace/Delete/Tab -> "CANCEL"
       - '#' -> "ENTER"
     """
-    # Kilit tuş kodlarını yut (log spamını da önlemek için)
-    if code in (69, 58, 70):  # NumLock, CapsLock, ScrollLock
-        return None
-
-    # NAV → rakam
-    _NAV_NUM = {
-        102: "7",  # HOME
-        103: "8",  # UP
-        104: "9",  # PAGEUP
-        105: "4",  # LEFT
-        106: "6",  # RIGHT
-        107: "1",  # END
-        108: "2",  # DOWN
-        109: "3",  # PAGEDOWN
-        110: "0",  # INSERT
-        # 111 (DELETE) -> CANCEL, aşağıda
-    }
-    if code in _NAV_NUM:
-        return _NAV_NUM[code]
-
-    if code in _MAIN_ROW_NUM:
-        return _MAIN_ROW_NUM[code]
-    if code in _KP_NUM:
-        return _KP_NUM[code]
-
-    if code in (28, 96):  # Enter, KP_Enter
-        return "ENTER"
-
-    if code in (1, 14, 111, 15):  # Esc, Backspace, Delete, Tab -> cancel
-        return "CANCEL"
-
-    if code in (43,):  # '#'
-        return "ENTER"
-
-    return None
+    # Kilit tuş kodları (69/58/70) tabloda yok -> None
+    return _KEYCODE_TO_SYM.get(code)
 
 
 # EVDEV thread
+# One state machine shared by whichever keypad source is running, so a
+# partially typed code is never split across two instances.
+_KEYPAD_SM: Optional[KeypadStateMachine] = None
+_KEYPAD_SM_LOCK = threading.Lock()
+
+def _keypad_sm() -> KeypadStateMachine:
+    global _KEYPAD_SM
+    with _KEYPAD_SM_LOCK:
+        if _KEYPAD_SM is None:
+            _KEYPAD_SM = KeypadStateMachine(opts_provider=_read_options_cached, speak_fn=speak, handle_charge_fn=_handle_charge)
+        return _KEYPAD_SM
+
+# Reconnect backoff for the keypad listeners: 0.5 s doubling to 5 s.
+# POST /keypad/reconnect sets the event to cut a pending wait short.
+KEYPAD_RETRY_BASE = 0.5
+KEYPAD_RETRY_MAX = 5.0
+_KEYPAD_RECONNECT = threading.Event()
+
+def _keypad_retry_wait(delay: float) -> float:
+    """Sleep up to `delay` (or until a reconnect is requested); return the next delay."""
+    if _KEYPAD_RECONNECT.wait(delay):
+        _KEYPAD_RECONNECT.clear()
+        return KEYPAD_RETRY_BASE
+    return min(delay * 2, KEYPAD_RETRY_MAX)
+
+def _keypad_key_sets(opts: dict) -> Tuple[frozenset, frozenset]:
+    """(ignore_keys, confirm_keys) from options as frozensets of key codes."""
+    # Opsiyonlardan ignore setini hazırla (yoksa 69/58/70 varsayılan)
+    try:
+        ignore_keys_cfg = opts.get("ignore_keys")
+        ikeys = frozenset(int(x) for x in (ignore_keys_cfg if ignore_keys_cfg is not None else [69, 58, 70]))
+    except Exception:
+        ikeys = frozenset((69, 58, 70))
+    # Ek ENTER kodları (opsiyonel)
+    try:
+        ckeys = frozenset(int(x) for x in (opts.get("confirm_keys") or []))
+    except Exception:
+        ckeys = frozenset()
+    return ikeys, ckeys
+
 def _evdev_thread():
     """Listen a physical USB keypad via evdev with auto-reconnect and rich key mapping."""
     if not _HAS_EVDEV:
         _log("WARN", "evdev not available; keypad_source=evdev cannot start")
         return
 
-    sm = KeypadStateMachine(opts_provider=_read_options, speak_fn=speak, handle_charge_fn=_handle_charge)
+    sm = _keypad_sm()
     IGNORED_KEY_NAMES = {"KEY_NUMLOCK", "KEY_CAPSLOCK", "KEY_SCROLLLOCK", "NUMLOCK", "CAPSLOCK", "SCROLLLOCK"}
+    delay = KEYPAD_RETRY_BASE
 
     while True:
         # Prefer explicitly configured device; otherwise scan /dev/input
@@ -1166,8 +2050,8 @@ def _evdev_thread():
         if not path:
             path = _find_keypad_device()
             if not path:
-                _log("WARN", "No keypad input device found under /dev/input (will retry in 5s)")
-                time.sleep(5.0)
+                _log("WARN", f"No keypad input device found under /dev/input (will retry in {delay:g}s)")
+                delay = _keypad_retry_wait(delay)
                 continue
             _log("INFO", f"Keypad(evdev) selected by scan: {path}")
         else:
@@ -1175,7 +2059,7 @@ def _evdev_thread():
                 _log("WARN", f"Configured keypad_device not found: {path} (falling back to scan)")
                 path = _find_keypad_device()
                 if not path:
-                    time.sleep(5.0)
+                    delay = _keypad_retry_wait(delay)
                     continue
                 _log("INFO", f"Keypad(evdev) fallback by scan: {path}")
             else:
@@ -1193,90 +2077,123 @@ def _evdev_thread():
             except Exception as e:
                 _log("WARN", f"Keypad(evdev) grab failed (non-fatal): {e}")
         except Exception as e:
-            _log("WARN", f"Failed to open input device {path}: {e} (retry in 5s)")
-            time.sleep(5.0)
+            _log("WARN", f"Failed to open input device {path}: {e} (retry in {delay:g}s)")
+            delay = _keypad_retry_wait(delay)
             continue
+        delay = KEYPAD_RETRY_BASE
 
-        # Opsiyonlardan ignore setini hazırla (yoksa 69/58/70 varsayılan)
-        try:
-            ignore_keys_cfg = opts_local.get("ignore_keys")
-            ikeys = set(int(x) for x in (ignore_keys_cfg if ignore_keys_cfg is not None else [69, 58, 70]))
-        except Exception:
-            ikeys = {69, 58, 70}
+        opts_keys = opts_local
+        ikeys, ckeys = _keypad_key_sets(opts_keys)
 
         try:
-            for event in dev.read_loop():
-                # Sadece key-down (value==1)
-                if event.type != ecodes.EV_KEY or getattr(event, "value", None) != 1:
+            # Sleep in select() until the fd is readable, then drain everything
+            # the kernel has buffered with one read() and dispatch it in a batch
+            while True:
+                ready, _, _ = select.select([dev.fd], [], [], 5.0)
+                if not ready:
                     continue
-
-                # Koda göre erken filtre (Num/Caps/Scroll)
                 try:
-                    ev_code = int(getattr(event, "code", -1))
-                except Exception:
-                    ev_code = -1
-                if ev_code in ikeys:
+                    events = list(dev.read())
+                except BlockingIOError:
                     continue
-
-                # İsimden çöz
-                sym = None
-                name = ""
-                try:
-                    key = categorize(event)
-                    name = key.keycode if isinstance(key.keycode, str) else (
-                        key.keycode[0] if isinstance(key.keycode, (list, tuple)) and key.keycode else ""
-                    )
-                    if name in IGNORED_KEY_NAMES:
+                # Rebuild the key sets only when the cached options object changes
+                opts_now = _read_options_cached()
+                if opts_now is not opts_keys:
+                    opts_keys = opts_now
+                    ikeys, ckeys = _keypad_key_sets(opts_keys)
+                for event in events:
+                    # Sadece key-down (value==1)
+                    if event.type != ecodes.EV_KEY or getattr(event, "value", None) != 1:
                         continue
-                    sym = _map_keycode_name(name)
-                except Exception:
-                    name = ""
 
-                # Fallback: koda göre çöz (NAV→rakam/ENTER/CANCEL dahil)
-                if not sym:
+                    # Koda göre erken filtre (Num/Caps/Scroll)
                     try:
-                        sym = _map_keycode_int(ev_code)
+                        ev_code = int(getattr(event, "code", -1))
                     except Exception:
-                        sym = None
+                        ev_code = -1
+                    if ev_code in ikeys:
+                        continue
 
-                # Ek ENTER kodları (opsiyonel)
-                if not sym:
+                    # İsimden çöz
+                    sym = None
+                    name = ""
                     try:
-                        ckeys = set(int(x) for x in (opts_local.get("confirm_keys") or []))
-                        if ev_code in ckeys:
-                            sym = "ENTER"
+                        key = categorize(event)
+                        name = key.keycode if isinstance(key.keycode, str) else (
+                            key.keycode[0] if isinstance(key.keycode, (list, tuple)) and key.keycode else ""
+                        )
+                        if name in IGNORED_KEY_NAMES:
+                            continue
+                        sym = _map_keycode_name(name)
                     except Exception:
-                        pass
+                        name = ""
 
-                _log("DEBUG", f"evdev keydown code={ev_code} name={name or '-'} -> {sym or '-'}")
+                    # Fallback: koda göre çöz (NAV→rakam/ENTER/CANCEL dahil)
+                    if not sym:
+                        try:
+                            sym = _map_keycode_int(ev_code)
+                        except Exception:
+                            sym = None
 
-                if sym:
-                    human = {"ENTER": "Enter", "CANCEL": "Cancel"}.get(sym, sym)
-                    _log("INFO", f"Pressed key {human} (evdev)")
-                    sm.on_sym(sym)
-                else:
-                    # Num/Caps/Scroll zaten yutuldu; kalan 'unmapped'ları düşük gürültüde tut
-                    raw = name or f"code={ev_code}"
-                    _log("INFO", f"Pressed key {raw} (evdev) [unmapped]")
+                    # Ek ENTER kodları (opsiyonel)
+                    if not sym and ev_code in ckeys:
+                        sym = "ENTER"
+
+                    _dbg(lambda: f"evdev keydown code={ev_code} name={name or '-'} -> {sym or '-'}")
+
+                    if sym:
+                        human = {"ENTER": "Enter", "CANCEL": "Cancel"}.get(sym, sym)
+                        _log("INFO", f"Pressed key {human} (evdev)")
+                        sm.on_sym(sym)
+                    else:
+                        # Num/Caps/Scroll zaten yutuldu; kalan 'unmapped'ları düşük gürültüde tut
+                        raw = name or f"code={ev_code}"
+                        _log("INFO", f"Pressed key {raw} (evdev) [unmapped]")
 
         except OSError as e:
             _log("WARN", f"Keypad(evdev) device error: {e} (will retry)")
             try: dev.close()
             except Exception: pass
-            time.sleep(2.0)
+            delay = _keypad_retry_wait(delay)
             continue
         except Exception as e:
-            _log("WARN", f"Keypad(evdev) loop exception: {e}\n{traceback.format_exc()}")
+            _log("WARN", f"Keypad(evdev) loop exception: {e}")
+            _dbg(traceback.format_exc)
             try: dev.close()
             except Exception: pass
-            time.sleep(2.0)
+            delay = _keypad_retry_wait(delay)
             continue
 
-def _find_keypad_device(patterns=("event*",)):
+DEVSCAN_LOG_INTERVAL = 60.0
+_DEVSCAN_LOG_TS = float("-inf")
+_LAST_GOOD_DEVICE: Optional[str] = None
+
+def _keypad_candidate(p: str) -> bool:
     try:
+        dev = InputDevice(p)
+        try:
+            name = (dev.name or "").lower()
+            _log("INFO", f"EVDEV: candidate {p} name='{dev.name}'")
+            return any(k in name for k in ("keyboard", "keypad", "rapoo", "usb"))
+        finally:
+            dev.close()
+    except Exception as e:
+        _log("WARN", f"EVDEV: open failed {p}: {e}")
+        return False
+
+def _find_keypad_device(patterns=("event*",)):
+    global _DEVSCAN_LOG_TS, _LAST_GOOD_DEVICE
+    # last device that worked: one open instead of a full rescan on USB hiccups
+    last = _LAST_GOOD_DEVICE
+    if last and os.path.exists(last) and _keypad_candidate(last):
+        return last
+
+    # diagnostic dumps at most once per DEVSCAN_LOG_INTERVAL (retry loop runs every few seconds)
+    now = time.monotonic()
+    if now - _DEVSCAN_LOG_TS >= DEVSCAN_LOG_INTERVAL and _log_enabled("INFO"):
+        _DEVSCAN_LOG_TS = now
         # quick dump for debugging
         try:
-            import os
             listing = []
             if os.path.isdir("/dev/input"):
                 for name in sorted(os.listdir("/dev/input")):
@@ -1296,19 +2213,19 @@ def _find_keypad_device(patterns=("event*",)):
             _log("INFO", "EVDEV: /proc/bus/input/devices:\n" + txt)
         except Exception as e:
             _log("WARN", f"EVDEV: cannot read /proc/bus/input/devices: {e}")
-    except Exception:
-        pass
 
-    for p in glob.glob("/dev/input/" + patterns[0]):
-        try:
-            dev = InputDevice(p)
-            name = (dev.name or "").lower()
-            _log("INFO", f"EVDEV: candidate {p} name='{dev.name}'")
-            if any(k in name for k in ("keyboard", "keypad", "rapoo", "usb")):
-                return dev.path
-        except Exception as e:
-            _log("WARN", f"EVDEV: open failed {p}: {e}")
-            continue
+    prefix = patterns[0].rstrip("*")  # only simple "name*" patterns are used
+    try:
+        with os.scandir("/dev/input") as it:
+            for entry in it:
+                if not entry.name.startswith(prefix):
+                    continue
+                p = entry.path
+                if p != last and _keypad_candidate(p):
+                    _LAST_GOOD_DEVICE = p
+                    return p
+    except OSError as e:
+        _log("WARN", f"EVDEV: cannot list /dev/input: {e}")
     return None
 
 
@@ -1323,6 +2240,33 @@ def _derive_ws_url(http_url: Optional[str]) -> Optional[str]:
         return "ws://" + u[len("http://"):] + "/api/websocket"
     return u  # assume already ws(s)
 
+def _ws_drain(ws, timeout: float) -> List[str]:
+    """Wait up to `timeout` for the socket to be readable, then return every
+    frame that is ready ('' marks a closed connection).
+
+    recv() is only called when bytes (or decrypted TLS data) are already
+    waiting, so it never sits on the socket timeout; a burst of events is
+    consumed in one wakeup.
+    """
+    sock = ws.sock
+    pending = getattr(sock, "pending", None)  # SSL: data already decrypted
+    if not (pending and pending()):
+        ready, _, _ = select.select([sock], [], [], timeout)
+        if not ready:
+            return []
+    frames: List[str] = []
+    while True:
+        raw = ws.recv()
+        frames.append(raw)
+        if not raw:
+            break
+        if pending and pending():
+            continue
+        ready, _, _ = select.select([sock], [], [], 0)
+        if not ready:
+            break
+    return frames
+
 def _ha_ws_thread():
     if not _HAS_WS:
         _log("WARN", "websocket-client not available; keypad_source=ha cannot start")
@@ -1334,62 +2278,182 @@ def _ha_ws_thread():
         return
     ws_url = opts.get("ha_ws_url") or _derive_ws_url(opts.get("ha_url") or "http://supervisor/core")
     event_type = opts.get("ha_event_type") or "keyboard_remote_command_received"
-    sm = KeypadStateMachine(opts_provider=_read_options, speak_fn=speak, handle_charge_fn=_handle_charge)
-
-    try:
-        ws = websocket.create_connection(ws_url, timeout=8)  # type: ignore
-    except Exception as e:
-        _log("WARN", f"HA WS: connection failed: {e}")
-        return
+    sm = _keypad_sm()
+    delay = KEYPAD_RETRY_BASE
 
-    def _send(obj):
+    while True:
         try:
-            ws.send(json.dumps(obj))
-        except Exception:
-            pass
+            ws = websocket.create_connection(ws_url, timeout=8)  # type: ignore
+        except Exception as e:
+            _log("WARN", f"HA WS: connection failed: {e} (retry in {delay:g}s)")
+            delay = _keypad_retry_wait(delay)
+            continue
 
-    try:
-        # Expect auth_required -> auth_ok
-        _ = ws.recv()
-        _send({"type": "auth", "access_token": token})
-        _ = ws.recv()
-        # Subscribe to events
-        _send({"id": 1, "type": "subscribe_events", "event_type": event_type})
-        _log("INFO", f"HA WS: subscribed to {event_type}")
+        def _send(obj):
+            try:
+                ws.send(json.dumps(obj))
+            except Exception:
+                pass
 
-        while True:
-            raw = ws.recv()
-            if not raw:
-                break
+        try:
+            # Expect auth_required -> auth_ok
+            _ = ws.recv()
+            _send({"type": "auth", "access_token": token})
+            _ = ws.recv()
+            # Subscribe to events
+            _send({"id": 1, "type": "subscribe_events", "event_type": event_type})
+            _log("INFO", f"HA WS: subscribed to {event_type}")
+            delay = KEYPAD_RETRY_BASE
+
+            closed = False
+            while not closed:
+                for raw in _ws_drain(ws, 1.0):
+                    if not raw:
+                        closed = True
+                        break
+                    try:
+                        msg = _json_loads(raw)
+                    except Exception:
+                        continue
+                    if msg.get("type") != "event":
+                        continue
+                    data = ((msg.get("event") or {}).get("data") or {})
+                    sym = None
+                    if "key_code" in data:
+                        try:
+                            sym = _map_keycode_int(int(data["key_code"]))
+                        except Exception:
+                            sym = None
+                    if not sym and "key" in data and isinstance(data["key"], str):
+                        sym = _map_keycode_name(data["key"])
+                    if not sym and "key_name" in data and isinstance(data["key_name"], str):
+                        sym = _map_keycode_name(data["key_name"])
+                    if sym:
+                        sm.on_sym(sym)
+            _log("WARN", f"HA WS: connection closed (reconnect in {delay:g}s)")
+        except Exception as e:
+            _log("WARN", f"HA WS: loop error: {e} (reconnect in {delay:g}s)")
+        finally:
             try:
-                msg = json.loads(raw)
+                ws.close()
             except Exception:
-                continue
-            if msg.get("type") != "event":
-                continue
-            data = ((msg.get("event") or {}).get("data") or {})
-            sym = None
-            if "key_code" in data:
+                pass
+        delay = _keypad_retry_wait(delay)
+
+
+# HA state watcher: a second WebSocket with subscribe_entities for just the
+# configured machine sensors. HA sends their current states first and then
+# only their changes, so activation confirmation can wait for the event
+# instead of polling REST and /machines can answer from memory.
+# _HA_STATES_LIVE is False (and the states are dropped) while the socket is
+# down. An idle socket is pinged every HA_WS_PING_INTERVAL seconds; a missing
+# pong means a half-open connection and forces a reconnect.
+_RUNNING_STATES = frozenset(("on", "true", "1", "running"))
+_HA_STATES: Dict[str, str] = {}
+_HA_STATES_COND = threading.Condition()
+_HA_STATES_LIVE = False
+HA_WS_PING_INTERVAL = 30.0
+
+def _set_states_live(live: bool) -> None:
+    global _HA_STATES_LIVE
+    with _HA_STATES_COND:
+        _HA_STATES_LIVE = live
+        if not live:
+            _HA_STATES.clear()
+        _HA_STATES_COND.notify_all()
+
+def _ha_cached_state(entity_id: str) -> Optional[str]:
+    """Latest state seen by the watcher, or None if unknown or not connected."""
+    with _HA_STATES_COND:
+        return _HA_STATES.get(entity_id) if _HA_STATES_LIVE else None
+
+def _watched_sensors(opts: dict) -> List[str]:
+    ids, _wm = _machine_ids(opts)
+    return sorted({_machine_entities(mid, opts)[1] for mid in ids})
+
+def _apply_entity_event(ev: dict) -> None:
+    """Fold one subscribe_entities event (a=added, c=changed, r=removed) into _HA_STATES."""
+    with _HA_STATES_COND:
+        for eid, st in (ev.get("a") or {}).items():
+            if st.get("s") is not None:
+                _HA_STATES[eid] = st["s"]
+        for eid, diff in (ev.get("c") or {}).items():
+            state = (diff.get("+") or {}).get("s")
+            if state is not None:
+                _HA_STATES[eid] = state
+        for eid in ev.get("r") or []:
+            _HA_STATES.pop(eid, None)
+        _HA_STATES_COND.notify_all()
+
+def _ha_state_thread():
+    while True:
+        opts = _read_options_cached()
+        token = _resolve_token(opts.get("ha_token"))
+        if not token or bool(opts.get("simulate", False)):
+            time.sleep(5.0)
+            continue
+        ws_url = opts.get("ha_ws_url") or _derive_ws_url(opts.get("ha_url") or "http://supervisor/core")
+        sensors = _watched_sensors(opts)
+        ws = None
+        resubscribe = False
+        try:
+            ws = websocket.create_connection(ws_url, timeout=8)  # type: ignore
+            _ = ws.recv()  # auth_required
+            ws.send(json.dumps({"type": "auth", "access_token": token}))
+            if (_json_loads(ws.recv() or "{}").get("type")) != "auth_ok":
+                raise RuntimeError("auth rejected")
+            ws.send(json.dumps({"id": 1, "type": "subscribe_entities", "entity_ids": sensors}))
+            ws.settimeout(HA_WS_PING_INTERVAL)
+            _set_states_live(True)
+            _log("INFO", f"HA WS: watching {len(sensors)} machine sensors")
+            msg_id = 1
+            ping_pending = False
+            while True:
+                # Machine sensors changed in options: subscribe again with the new list
+                if _watched_sensors(_read_options_cached()) != sensors:
+                    resubscribe = True
+                    break
                 try:
-                    sym = _map_keycode_int(int(data["key_code"]))
+                    raw = ws.recv()
+                except websocket.WebSocketTimeoutException:  # type: ignore
+                    if ping_pending:
+                        raise RuntimeError("no pong from HA (connection lost)")
+                    msg_id += 1
+                    ws.send(json.dumps({"id": msg_id, "type": "ping"}))
+                    ping_pending = True
+                    continue
+                if not raw:
+                    break
+                try:
+                    msg = _json_loads(raw)
                 except Exception:
-                    sym = None
-            if not sym and "key" in data and isinstance(data["key"], str):
-                sym = _map_keycode_name(data["key"])
-            if not sym and "key_name" in data and isinstance(data["key_name"], str):
-                sym = _map_keycode_name(data["key_name"])
-            if sym:
-                sm.on_sym(sym)
-    except Exception as e:
-        _log("WARN", f"HA WS: loop error: {e}")
-    finally:
-        try:
-            ws.close()
-        except Exception:
-            pass
+                    continue
+                kind = msg.get("type")
+                if kind == "pong":
+                    ping_pending = False
+                elif kind == "result" and msg.get("id") == 1 and not msg.get("success"):
+                    raise RuntimeError(f"subscribe_entities failed: {msg.get('error')}")
+                elif kind == "event" and msg.get("id") == 1:
+                    _apply_entity_event(msg.get("event") or {})
+        except Exception as e:
+            _log("WARN", f"HA WS: state watcher error: {e}")
+        finally:
+            _set_states_live(False)
+            if ws is not None:
+                try:
+                    ws.close()
+                except Exception:
+                    pass
+        if not resubscribe:
+            time.sleep(5.0)
 
+def start_state_watcher():
+    if not _HAS_WS:
+        return
+    threading.Thread(target=_ha_state_thread, name="ha-states", daemon=True).start()
 
 def start_keypad_listener():
+    _keypad_sm()
     opts = _read_options()
     source = (opts.get("keypad_source") or "ha").lower()
     if source == "evdev":
@@ -1413,11 +2477,18 @@ def start_keypad_listener():
 def on_start():
     ensure_bootstrap_files()
     _log("INFO", "WMPS API started.")
+    start_tts_worker()
     start_keypad_listener()
+    start_state_watcher()
+
+@app.on_event("shutdown")
+def on_stop():
+    flush_accounts()
+    flush_transactions()
 
 @app.get("/ping")
 def ping():
-    return {"ok": True, "ts": datetime.now(timezone.utc).isoformat()}
+    return {"ok": True, "ts": _iso_now()}
 
 @app.get("/debug/tts")
 def debug_tts(msg: str = "Hello from WMPS"):
@@ -1431,10 +2502,16 @@ def debug_tts(msg: str = "Hello from WMPS"):
     except Exception as e:
         return {"ok": False, "error": str(e)}
 
+@app.post("/keypad/reconnect")
+def keypad_reconnect():
+    """Wake a keypad listener waiting to retry, so it reconnects right away."""
+    _KEYPAD_RECONNECT.set()
+    return {"ok": True}
 
-@app.get("/", response_class=HTMLResponse)
-def root_ui():
-    return HTMLResponse("""
+
+# Control panel page: encoded once at import and served with an ETag, so
+# repeat loads revalidate with a 304 instead of re-sending the page.
+_ROOT_HTML = """
 <!doctype html>
 <html>
 <head>
@@ -1769,14 +2846,22 @@ html, body {
   height: auto;
 }
 
+/* Keep style/layout invalidation from a card's subtree inside the card */
+.card{ contain: layout style; }
+
+/* Position comes from --win-x/--win-y so dragging only re-composites */
 [data-win]{
   position: absolute;
+  left: 0;
+  top: 0;
+  transform: translate3d(var(--win-x, 0px), var(--win-y, 0px), 0);
+  will-change: transform;
   width: 520px;
   min-width: 320px;
   min-height: 160px;
 }
 
-[data-win].dragging{
+[data-win][data-dragging="1"]{
   opacity:.9;
   box-shadow: 0 0 0 2px rgba(59,130,246,.35), var(--shadow-1);
 }
@@ -1788,7 +2873,8 @@ html, body {
   cursor: move;
 }
 
-[data-win] .win-title { touch-action: none; }
+[data-win] .win-title,
+[data-win] .resize-handle { touch-action: none; }
 
 [data-win] .resize-handle{
   position:absolute; right:6px; bottom:6px;
@@ -1805,7 +2891,7 @@ html, body {
 
 @media (max-width: 720px){
   .layout-canvas{ min-height: 1200px; }
-  [data-win]{ width: calc(100% - 24px); left:12px !important; }
+  [data-win]{ width: calc(100% - 24px); transform: translate3d(12px, var(--win-y, 0px), 0) !important; }
 }
 
 /* Make the canvas/page expand with content */
@@ -2142,22 +3228,111 @@ function pill2(state, err) {
   return `<span class="pill ${cls}">${txt}</span>`;
 }
 
+// ------- Stale-while-revalidate JSON cache -------
+// IndexedDB holds the last payload per URL so a repeat visit can paint before
+// the network answers; localStorage is the fallback when IDB is unavailable.
+const SWR_DB = 'wmps_cache';
+const SWR_STORE = 'json';
+const SWR_LS_PREFIX = 'wmps.swr.';
+const _swrSeen = new Set();   // URLs already served fresh in this page session
+const _swrLast = new Map();   // URL -> last payload text written to the cache
+let _swrDbPromise = null;
+
+function swrDb() {
+  if (_swrDbPromise) return _swrDbPromise;
+  _swrDbPromise = new Promise(resolve => {
+    try {
+      if (!window.indexedDB) return resolve(null);
+      const req = indexedDB.open(SWR_DB, 1);
+      req.onupgradeneeded = () => req.result.createObjectStore(SWR_STORE);
+      req.onsuccess = () => resolve(req.result);
+      req.onerror = () => resolve(null);
+    } catch (_) { resolve(null); }
+  });
+  return _swrDbPromise;
+}
+
+async function swrGet(key) {
+  const db = await swrDb();
+  if (!db) {
+    try { return localStorage.getItem(SWR_LS_PREFIX + key); } catch (_) { return null; }
+  }
+  return new Promise(resolve => {
+    try {
+      const req = db.transaction(SWR_STORE, 'readonly').objectStore(SWR_STORE).get(key);
+      req.onsuccess = () => resolve(req.result ?? null);
+      req.onerror = () => resolve(null);
+    } catch (_) { resolve(null); }
+  });
+}
+
+async function swrPut(key, text) {
+  if (_swrLast.get(key) === text) return;
+  _swrLast.set(key, text);
+  const db = await swrDb();
+  if (!db) {
+    try { localStorage.setItem(SWR_LS_PREFIX + key, text); } catch (_) {}
+    return;
+  }
+  try { db.transaction(SWR_STORE, 'readwrite').objectStore(SWR_STORE).put(text, key); } catch (_) {}
+}
+
+// Render the cached payload immediately (first load only), then revalidate from
+// the network and re-render only if the payload differs from what was shown.
+async function cacheFetch(url, onData) {
+  let shown = null;
+  if (!_swrSeen.has(url)) {
+    shown = await swrGet(url);
+    if (shown != null) {
+      try { onData(JSON.parse(shown)); } catch (_) { shown = null; }
+    }
+  }
+
+  let text;
+  try {
+    const res = await fetch(url, { cache: 'no-store' });
+    if (!res.ok) throw new Error('http ' + res.status);
+    text = await res.text();
+  } catch (e) {
+    if (shown != null) return;   // keep the cached view
+    throw e;
+  }
+
+  _swrSeen.add(url);
+  if (text !== shown) onData(JSON.parse(text));
+  swrPut(url, text);
+}
+
+
 const MACHINE_DEADLINES = {};
-let machineCountdownInterval = null;
+let MACHINES_STATE = [];   // last /machines payload, patched optimistically after a charge
+let machineTickerRaf = 0;
+// Countdown cells, refreshed only by renderMachinesTable
+let deadlineCells = [];
+
+// Coalesce back-to-back re-render requests: at most one run of each renderer
+// per animation frame.
+const _renderPending = new Set();
+function scheduleRender(fn) {
+  if (_renderPending.has(fn)) return;
+  _renderPending.add(fn);
+  requestAnimationFrame(async () => {
+    _renderPending.delete(fn);
+    try { await fn(); } catch (e) { console.error(e); }
+  });
+}
 
 async function renderMachines() {
   const host = document.getElementById('machines_table');
   if (!host) return;
 
-  let items = [];
   try {
-    const res = await fetch('./machines');
-    const jsRaw = await res.json();
-    items = (jsRaw && jsRaw.machines) ? jsRaw.machines : [];
-
-    renderMachinesTable(items);
-
-    startMachineTicker();
+    await cacheFetch('./machines', jsRaw => {
+      const items = (jsRaw && jsRaw.machines) ? jsRaw.machines : [];
+      MACHINES_STATE = items;
+      renderMachinesTable(items);
+      startMachineTicker();
+    });
   } catch (e) {
     host.innerHTML = `<div class="error-banner">Failed to load machines.</div>`;
     try { fitCanvasToCards(); } catch(_) {}
@@ -2166,32 +3341,38 @@ async function renderMachines() {
 }
 
 function startMachineTicker() {
-  if (machineCountdownInterval) return;
-  machineCountdownInterval = setInterval(() => {
+  if (machineTickerRaf) return;
+  // Self-rescheduling rAF loop: no callback pile-up while the main thread is busy
+  const tick = () => {
     const now = Date.now();
-    document.querySelectorAll('#machines_table td[data-mid]').forEach(td => {
-      const raw = td.getAttribute('data-deadline');
-      const deadline = raw ? parseInt(raw, 10) : 0;
-      if (!deadline) { td.textContent = ''; return; }
+    for (let i = 0; i < deadlineCells.length; i++) {
+      const td = deadlineCells[i];
+      const deadline = td._deadline;
+      if (!deadline) continue;
 
       const ms = deadline - now;
       if (ms <= 0) {
-          td.textContent = '';
-          const mid = td.getAttribute('data-mid');
-          if (mid && window.MACHINE_DEADLINES) {
-            delete window.MACHINE_DEADLINES[mid];
-          }
-          td.removeAttribute('data-deadline');
-          return;
+        td.textContent = '';
+        const mid = td.dataset.mid;
+        if (mid && window.MACHINE_DEADLINES) {
+          delete window.MACHINE_DEADLINES[mid];
         }
+        td.removeAttribute('data-deadline');
+        td._deadline = 0;
+        continue;
+      }
 
-
+      // Only touch the DOM when the displayed second changes
       const total = Math.ceil(ms / 1000);
+      if (td._lastSec === total) continue;
+      td._lastSec = total;
       const m = Math.floor(total / 60);
       const s = String(total % 60).padStart(2, '0');
       td.textContent = `${m}:${s}`;
-    });
-  }, 1000);
+    }
+    machineTickerRaf = requestAnimationFrame(tick);
+  };
+  machineTickerRaf = requestAnimationFrame(tick);
 }
 
 function statusPill(status) {
@@ -2207,48 +3388,97 @@ function statusPill(status) {
 }
 
 
+// Shared NZ date formatter (constructing Intl.DateTimeFormat is expensive)
+const NZ_FMT = new Intl.DateTimeFormat("en-NZ", {
+  dateStyle: "short",
+  timeStyle: "short",
+  timeZone: "Pacific/Auckland"
+});
+
+// Per-render memo on the raw timestamp string; many rows share the same value
+function nzDateFormatter() {
+  const memo = new Map();
+  return (ts) => {
+    if (!ts) return "";
+    let out = memo.get(ts);
+    if (out === undefined) {
+      out = NZ_FMT.format(new Date(ts));
+      memo.set(ts, out);
+    }
+    return out;
+  };
+}
+
+
+// ------- DOM row helpers -------
+// Cells are filled via textContent: no HTML parsing, values are escaped for free
+function textRow(values) {
+  const tr = document.createElement('tr');
+  for (const v of values) {
+    const td = document.createElement('td');
+    td.textContent = v ?? '';
+    tr.appendChild(td);
+  }
+  return tr;
+}
+
+function pillEl(cls, txt) {
+  const span = document.createElement('span');
+  span.className = `pill ${cls}`;
+  span.textContent = txt;
+  return span;
+}
+
+// Render a static <thead> once and return the empty <tbody> to fill
+function tableSkeleton(host, headers) {
+  host.innerHTML = `
+    <table>
+      <thead>
+        <tr>${headers.map(h => `<th>${h}</th>`).join('')}</tr>
+      </thead>
+      <tbody></tbody>
+    </table>
+  `;
+  return host.querySelector('tbody');
+}
+
+
 async function renderHistory() {
   const wrap = document.getElementById('history_wrap');
   const tbody = document.querySelector('#history tbody');
   if (!tbody) return;
 
   try {
-    const res = await fetch('./history?limit=100');
-    const js = await res.json();
-
-    const fmt = new Intl.DateTimeFormat("en-NZ", {
-      dateStyle: "short",
-      timeStyle: "short",
-      timeZone: "Pacific/Auckland"
-    });
-
-    const rows = (js.items || []).map(r => {
-      const t = r.timestamp ? fmt.format(new Date(r.timestamp)) : "";
-      const ok = (String(r.success).toLowerCase() === 'true');
-      const pill = ok
-        ? '<span class="pill pill-ok">True</span>'
-        : '<span class="pill pill-err">False</span>';
-
-      return `
-        <tr>
-          <td>${t}</td>
-          <td>${r.tenant_code || ''}</td>
-          <td>${r.machine_number || ''}</td>
-          <td>${r.amount_charged || ''}</td>
-          <td>${r.balance_after || ''}</td>
-          <td>${r.cycle_minutes || ''}</td>
-          <td>${pill}</td>
-        </tr>`;
-    }).join('');
-
-    tbody.innerHTML = rows;
-
-    if (wrap) wrap.scrollTop = 0;
+    await cacheFetch('./history?limit=100', js => renderHistoryRows(tbody, wrap, js));
   } catch (e) {
     tbody.innerHTML = `<tr><td colspan="7"><div class="error-banner">Failed to load history.</div></td></tr>`;
   }
 }
 
+function renderHistoryRows(tbody, wrap, js) {
+  const fmtDate = nzDateFormatter();
+
+  const frag = document.createDocumentFragment();
+  for (const r of (js.items || [])) {
+    const ok = (String(r.success).toLowerCase() === 'true');
+    const tr = textRow([
+      fmtDate(r.timestamp),
+      r.tenant_code || '',
+      r.machine_number || '',
+      r.amount_charged || '',
+      r.balance_after || '',
+      r.cycle_minutes || ''
+    ]);
+    const td = document.createElement('td');
+    td.appendChild(pillEl(ok ? 'pill-ok' : 'pill-err', ok ? 'True' : 'False'));
+    tr.appendChild(td);
+    frag.appendChild(tr);
+  }
+  tbody.replaceChildren(frag);
+
+  if (wrap) wrap.scrollTop = 0;
+}
+
 
 // ------- Settings table renderer -------
 function _csvJoin(arr) {
@@ -2279,24 +3509,25 @@ function buildSettingsKV(settings){
 function renderSettingsTable(settings){
   const host = document.getElementById('cfg_table');
   if (!host) return;
-  const rows = buildSettingsKV(settings || {});
-  const trs = rows.map(([k,v]) => `
-    <tr>
-      <td>${k}</td>
-      <td>${(v === '' || v == null) ? '[empty]' : v}</td>
-    </tr>
-  `).join('');
-    host.innerHTML = `
-    <table>
-      <thead>
-        <tr><th>Setting</th><th>Value</th></tr>
-      </thead>
-      <tbody>
-        ${trs}
-      </tbody>
-    </table>
-  `;
-    try { fitCanvasToCards(); } catch(_) {}
+
+  // Skeleton is built once; later renders patch cell text in place
+  let tbody = host.querySelector('tbody');
+  if (!tbody) tbody = tableSkeleton(host, ['Setting', 'Value']);
+
+  const kv = buildSettingsKV(settings || {});
+  const rows = tbody.rows;
+  const frag = document.createDocumentFragment();
+  kv.forEach(([k, v], i) => {
+    const vals = [k, (v === '' || v == null) ? '[empty]' : String(v)];
+    const tr = rows[i];
+    if (!tr) { frag.appendChild(textRow(vals)); return; }
+    for (let c = 0; c < 2; c++) {
+      if (tr.cells[c].textContent !== vals[c]) tr.cells[c].textContent = vals[c];
+    }
+  });
+  while (rows.length > kv.length) tbody.deleteRow(-1);
+  if (frag.childNodes.length) tbody.appendChild(frag);
+  try { fitCanvasToCards(); } catch(_) {}
 }
 
 function populateQuickChargeMachines(cfg) {
@@ -2342,7 +3573,10 @@ function renderQuickChargeResult(res) {
   if (!host) return;
 
   if (!res || !res.ok) {
-    host.innerHTML = `<div class="error-banner">Charge failed: ${(res && res.status) || 'ERROR'}</div>`;
+    const banner = document.createElement('div');
+    banner.className = 'error-banner';
+    banner.textContent = `Charge failed: ${(res && res.status) || 'ERROR'}`;
+    host.replaceChildren(banner);
     try { fitCanvasToCards(); } catch(_) {}
     return;
   }
@@ -2358,21 +3592,11 @@ function renderQuickChargeResult(res) {
     ['Minutes',        res.cycle_minutes  != null ? String(res.cycle_minutes)      : '']
   ];
 
-  const thead = cells.map(([label]) => `<th>${label}</th>`).join('');
-  const tds = cells.map(([label, value]) => {
-    if (label === 'Status') {
-      const color = (res.status === 'OK' ? '#4ade80' : '#f87171');
-      return `<td style="color:${color}">${value}</td>`;
-    }
-    return `<td>${value}</td>`;
-  }).join('');
-
-  host.innerHTML = `
-    <table>
-      <thead><tr>${thead}</tr></thead>
-      <tbody><tr>${tds}</tr></tbody>
-    </table>
-  `;
+  const tbody = tableSkeleton(host, cells.map(([label]) => label));
+  const tr = textRow(cells.map(([, value]) => value));
+  const statusIdx = cells.findIndex(([label]) => label === 'Status');
+  tr.cells[statusIdx].style.color = (res.status === 'OK' ? '#4ade80' : '#f87171');
+  tbody.replaceChildren(tr);
 
   // içerik büyüyünce kart/sayfa otomatik uyum sağlasın
   try { fitCanvasToCards(); } catch(_) {}
@@ -2433,18 +3657,17 @@ function showUserError(msg){
 
 
 let USERS_CACHE = {};
+let USERS_SORTED = [];   // [code, rec] pairs, re-sorted only when USERS_CACHE changes
 
 async function fetchAccounts() {
   try {
-    const res = await fetch('./accounts/list', { cache: 'no-store' });
-    if (!res.ok) throw new Error('http ' + res.status);
-
-    const js = await res.json().catch(() => ({}));
-    const incoming = (js && typeof js.accounts === 'object') ? js.accounts : null;
-
-    if (incoming && Object.keys(incoming).length > 0) {
-      USERS_CACHE = { ...USERS_CACHE, ...incoming };
-    }
+    await cacheFetch('./accounts/list', js => {
+      const incoming = (js && typeof js.accounts === 'object') ? js.accounts : null;
+      if (incoming && Object.keys(incoming).length > 0) {
+        USERS_CACHE = { ...USERS_CACHE, ...incoming };
+        USERS_SORTED = Object.entries(USERS_CACHE).sort((a,b)=> a[0].localeCompare(b[0]));
+      }
+    });
     return USERS_CACHE;
   } catch (e) {
     return USERS_CACHE;
@@ -2453,7 +3676,7 @@ async function fetchAccounts() {
 
 
 function sortedUserEntries() {
-  return Object.entries(USERS_CACHE).sort((a,b)=> a[0].localeCompare(b[0]));
+  return USERS_SORTED;
 }
 
 function populateUserSelect(selectedCode = "") {
@@ -2530,26 +3753,10 @@ function renderUserTable(rec) {
   if ((rec.balance ?? 0) > 0) balClass = 'balance-pos';
   if ((rec.balance ?? 0) < 0) balClass = 'balance-neg';
 
-  host.innerHTML = `
-    <table>
-      <thead>
-          <tr>
-            <th>Account ID</th>
-            <th>Name</th>
-            <th>Balance</th>
-            <th>Last transaction (UTC)</th>
-          </tr>
-        </thead>
-      <tbody>
-        <tr>
-          <td>${rec.tenant_code}</td>
-          <td>${rec.name || ''}</td>
-          <td class="${balClass}">${bal}</td>
-          <td>${last}</td>
-        </tr>
-      </tbody>
-    </table>
-  `;
+  const tbody = tableSkeleton(host, ['Account ID', 'Name', 'Balance', 'Last transaction (UTC)']);
+  const tr = textRow([rec.tenant_code, rec.name || '', bal, last]);
+  tr.cells[2].className = balClass;
+  tbody.replaceChildren(tr);
   try { fitCanvasToCards(); } catch(_) {}
 
 }
@@ -2617,13 +3824,35 @@ async function initUsersUI() {
 }
 
 
-function buildComboHTML(items){
-  if (!items.length) return `<div class="combo-empty">No results</div>`;
-  return items.map(([code, rec], idx) => {
+function comboItemEl(code, label, extra) {
+  const el = document.createElement('div');
+  el.className = 'combo-item';
+  el.setAttribute('role', 'option');
+  el.dataset.code = code;
+  Object.assign(el.dataset, extra || {});
+  el.textContent = label;
+  return el;
+}
+
+function comboEmptyEl(txt) {
+  const el = document.createElement('div');
+  el.className = 'combo-empty';
+  el.textContent = txt;
+  return el;
+}
+
+function buildComboItems(items){
+  const frag = document.createDocumentFragment();
+  if (!items.length) {
+    frag.appendChild(comboEmptyEl('No results'));
+    return frag;
+  }
+  items.forEach(([code, rec], idx) => {
     const name = (rec.name || '').trim();
     const label = name ? `${code} — ${name}` : code;
-    return `<div class="combo-item" role="option" data-code="${code}" data-idx="${idx}">${label}</div>`;
-  }).join('');
+    frag.appendChild(comboItemEl(code, label, { idx: String(idx) }));
+  });
+  return frag;
 }
 
 function showComboSuggestions(query=''){
@@ -2657,9 +3886,10 @@ function showComboSuggestions(query=''){
   }
 
   const hasAny = all.length > 0;
-  box.innerHTML =
-    `<div class="combo-item" role="option" data-code="" data-new="1">New user</div>` +
-    (hasAny ? buildComboHTML(filtered) : `<div class="combo-empty">No users found (CSV empty or not loaded)</div>`);
+  box.replaceChildren(
+    comboItemEl('', 'New user', { new: '1' }),
+    hasAny ? buildComboItems(filtered) : comboEmptyEl('No users found (CSV empty or not loaded)')
+  );
 
   box.classList.add('open');
   box.setAttribute('aria-expanded','true');
@@ -2813,9 +4043,10 @@ async function listAccounts() {
 
 
 async function loadConfig() {
-  const res = await fetch('./config');
-  const js = await res.json();
+  await cacheFetch('./config', applyConfig);
+}
 
+function applyConfig(js) {
   // populate inputs
   const wm = (Array.isArray(js.washing_machines) && js.washing_machines.length) ? js.washing_machines : [1,2,3];
   const dm = (Array.isArray(js.dryer_machines) && js.dryer_machines.length) ? js.dryer_machines : [4,5,6];
@@ -2960,10 +4191,16 @@ async function simulateCharge() {
       window.MACHINE_DEADLINES[String(ui.machine)] =
         Date.now() + Number(ui.cycle_minutes) * 60 * 1000;
 
-      // If you have a refresher, call it
-      if (typeof renderMachines === 'function') {
-        try { renderMachines(); } catch (_) {}
+      // Show the new countdown right away, then reconcile with the server
+      const mid = String(ui.machine);
+      const m = MACHINES_STATE.find(x => String(x.id) === mid);
+      if (m) {
+        m.state = 'on';
+        m.remaining_seconds = Number(ui.cycle_minutes) * 60;
+        renderMachinesTable(MACHINES_STATE);
+        startMachineTicker();
       }
+      scheduleRender(renderMachines);
       if (typeof refreshTenant === 'function' && ui.account_id) {
         try { refreshTenant(ui.account_id); } catch (_) {}
       }
@@ -2983,112 +4220,171 @@ async function simulateCharge() {
 
 
 
-function renderCsvTable(data, type) {
+function csvRow(type, r, fmtDate) {
+  if (type === 'accounts') {
+    return textRow([
+      r.tenant_code || '',
+      r.name || '',
+      r.balance ?? '',
+      fmtDate(r.last_transaction_utc)
+    ]);
+  }
+  return textRow([
+    fmtDate(r.timestamp),
+    r.tenant_code || '',
+    r.machine_number || '',
+    r.amount_charged || '',
+    r.balance_after || '',
+    r.cycle_minutes || '',
+    r.success || ''
+  ]);
+}
+
+// append=true adds rows under the existing table (next history page)
+function renderCsvTable(data, type, append = false) {
   const host = document.getElementById('csv_table');
   if (!host) return;
 
-  if (!data || !data.length) {
+  const existing = append ? host.querySelector('tbody') : null;
+  if (!existing && (!data || !data.length)) {
     host.innerHTML = `<div class="error-banner">No data found.</div>`;
     return;
   }
 
-  if (type === 'accounts') {
-    const rows = data.map(acc => {
-      const date = acc.last_transaction_utc
-          ? new Intl.DateTimeFormat("en-NZ", { dateStyle: "short", timeStyle: "short", timeZone: "Pacific/Auckland" })
-              .format(new Date(acc.last_transaction_utc))
-          : "";
-      return `
-        <tr>
-          <td>${acc.tenant_code || ''}</td>
-          <td>${acc.name || ''}</td>
-          <td>${acc.balance ?? ''}</td>
-          <td>${date}</td>
-        </tr>`;
-    }).join("");
+  const fmtDate = nzDateFormatter();
+  const frag = document.createDocumentFragment();
+  for (const r of (data || [])) frag.appendChild(csvRow(type, r, fmtDate));
 
-    host.innerHTML = `
-      <table>
-        <thead>
-          <tr>
-            <th>Account ID</th>
-            <th>Name</th>
-            <th>Balance</th>
-            <th>Last transaction</th>
-          </tr>
-        </thead>
-        <tbody>${rows}</tbody>
-      </table>
-    `;
-  } else {
-    // transactions
-    const rows = data.map(t => {
-      const date = t.timestamp
-          ? new Intl.DateTimeFormat("en-NZ", { dateStyle: "short", timeStyle: "short", timeZone: "Pacific/Auckland" })
-              .format(new Date(t.timestamp))
-          : "";
-      return `
-        <tr>
-          <td>${date}</td>
-          <td>${t.tenant_code || ''}</td>
-          <td>${t.machine_number || ''}</td>
-          <td>${t.amount_charged || ''}</td>
-          <td>${t.balance_after || ''}</td>
-          <td>${t.cycle_minutes || ''}</td>
-          <td>${t.success || ''}</td>
-        </tr>`;
-    }).join("");
+  if (existing) {
+    existing.appendChild(frag);
+    return;
+  }
 
-    host.innerHTML = `
-      <table>
-        <thead>
-          <tr>
-            <th>Time</th>
-            <th>Account ID</th>
-            <th>Machine</th>
-            <th>Charged</th>
-            <th>Balance after</th>
-            <th>Minutes</th>
-            <th>Success</th>
-          </tr>
-        </thead>
-        <tbody>${rows}</tbody>
-      </table>
-    `;
+  const tbody = (type === 'accounts')
+    ? tableSkeleton(host, ['Account ID', 'Name', 'Balance', 'Last transaction'])
+    : tableSkeleton(host, ['Time', 'Account ID', 'Machine', 'Charged', 'Balance after', 'Minutes', 'Success']);
+  tbody.replaceChildren(frag);
+}
+
+
+function accountRows() {
+  return USERS_SORTED.map(([tenant_code, rec]) => ({
+    tenant_code,
+    name: rec.name || '',
+    balance: rec.balance ?? '',
+    last_transaction_utc: rec.last_transaction_utc || ''
+  }));
+}
+
+let csvView = '';
+
+// Transactions are paged newest-first; older pages load as the table tail
+// scrolls into view. openData() bumps gen, so a reply that belongs to an
+// earlier opening is dropped instead of being rendered or moving offset.
+const TX_PAGE = { offset: 0, pageSize: 100, done: false, loading: false, gen: 0 };
+let txSentinel = null;
+let txSentinelObs = null;
+
+async function loadTxPage() {
+  if (TX_PAGE.done || TX_PAGE.loading) return;
+  TX_PAGE.loading = true;
+  const gen = TX_PAGE.gen;
+  try {
+    const res = await fetch(`./history?limit=${TX_PAGE.pageSize}&offset=${TX_PAGE.offset}`);
+    if (gen !== TX_PAGE.gen) return;
+    if (!res.ok) throw new Error('http ' + res.status);   // not "no more rows"
+    const js = await res.json();
+    if (gen !== TX_PAGE.gen) return;
+    const items = (js.items || []).reverse();
+    const first = TX_PAGE.offset === 0;
+    TX_PAGE.offset += items.length;
+    if (items.length < TX_PAGE.pageSize) TX_PAGE.done = true;
+    if (csvView !== 'transactions') return;
+
+    renderCsvTable(items, 'transactions', !first);
+    watchTxTail();
+  } finally {
+    if (gen === TX_PAGE.gen) TX_PAGE.loading = false;
   }
 }
 
+function watchTxTail() {
+  const host = document.getElementById('csv_table');
+  if (!host || !window.IntersectionObserver) return;
+  if (!txSentinelObs) {
+    txSentinelObs = new IntersectionObserver(entries => {
+      if (entries.some(e => e.isIntersecting)) loadTxPage();
+    }, { rootMargin: '200px' });
+  }
+  txSentinelObs.disconnect();
+  if (TX_PAGE.done) return;
+
+  if (!txSentinel) txSentinel = document.createElement('div');
+  host.appendChild(txSentinel);
+  // Re-observing fires an initial callback, so a still-visible tail keeps paging
+  txSentinelObs.observe(txSentinel);
+}
 
 async function openData(type) {
+  csvView = type;
   if (type === 'accounts') {
-    const res = await fetch('./accounts/list');
-    const js = await res.json();
-    const arr = Object.entries(js.accounts || {}).map(([tenant_code, rec]) => ({
-      tenant_code,
-      name: rec.name || '',
-      balance: rec.balance ?? '',
-      last_transaction_utc: rec.last_transaction_utc || ''
-    }));
-    renderCsvTable(arr, 'accounts');
+    // Serve from USERS_CACHE and revalidate in the background
+    if (!USERS_SORTED.length) await fetchAccounts();
+    const shown = USERS_SORTED;
+    renderCsvTable(accountRows(), 'accounts');
+    fetchAccounts().then(() => {
+      if (csvView === 'accounts' && USERS_SORTED !== shown) {
+        renderCsvTable(accountRows(), 'accounts');
+      }
+    });
   } else {
     // transactions
-    const res = await fetch('./history?limit=1000');
-    const js = await res.json();
-    renderCsvTable(js.items || [], 'transactions');
+    if (txSentinelObs) txSentinelObs.disconnect();
+    Object.assign(TX_PAGE, { offset: 0, done: false, loading: false, gen: TX_PAGE.gen + 1 });
+    await loadTxPage();
   }
 }
 
 
+// Rows are recycled across polls: machine id -> <tr>
+const machineRowMap = new Map();
+let machinesTbody = null;
+
 function renderMachinesTable(machines) {
   const host = document.getElementById('machines_table');
   if (!host) return;
 
   if (!machines || !machines.length) {
     host.innerHTML = `<div class="error-banner">No machines found.</div>`;
+    machinesTbody = null;
+    machineRowMap.clear();
+    deadlineCells = [];
     return;
   }
 
-  const rows = machines.map(m => {
+  // Build the table skeleton once; later renders only patch changed cells
+  if (!machinesTbody || !host.contains(machinesTbody)) {
+    host.innerHTML = `
+      <table>
+        <thead>
+          <tr>
+            <th>Machine</th>
+            <th>Status</th>
+            <th>Remaining</th>
+          </tr>
+        </thead>
+        <tbody></tbody>
+      </table>
+    `;
+    machinesTbody = host.querySelector('tbody');
+    machineRowMap.clear();
+  }
+
+  const seen = new Set();
+  const tickCells = [];
+  machines.forEach((m, idx) => {
+    const id = String(m.id);
+    seen.add(id);
     const machineName = `${m.category === 'washing' ? 'Washing' : 'Dryer'} - Machine ${m.id}`;
 
     let status =
@@ -3097,11 +4393,11 @@ function renderMachinesTable(machines) {
       m.state === 'disabled' ? 'Disabled' : 'Unknown';
 
     let remainingText = '';
-    let deadlineAttr = '';
+    let deadline = 0;
 
     // Client-side fallback: if server says Available but we started a simulation, show countdown
-    const clientDeadline = (window.MACHINE_DEADLINES && window.MACHINE_DEADLINES[String(m.id)])
-      ? Number(window.MACHINE_DEADLINES[String(m.id)]) : 0;
+    const clientDeadline = (window.MACHINE_DEADLINES && window.MACHINE_DEADLINES[id])
+      ? Number(window.MACHINE_DEADLINES[id]) : 0;
     const nowMs = Date.now();
     if (status !== 'Busy' && clientDeadline > nowMs) {
       status = 'Busy';
@@ -3113,41 +4409,60 @@ function renderMachinesTable(machines) {
         const mins = Math.floor(m.remaining_seconds / 60);
         const secs = (m.remaining_seconds % 60).toString().padStart(2, '0');
         remainingText = `${mins}:${secs}`;
-        const deadlineMs = Date.now() + (m.remaining_seconds * 1000);
-        deadlineAttr = ` data-mid="${String(m.id)}" data-deadline="${deadlineMs}"`;
+        deadline = nowMs + (m.remaining_seconds * 1000);
       } else if (clientDeadline > nowMs) {
         const ms = clientDeadline - nowMs;
         const total = Math.ceil(ms / 1000);
         const mins = Math.floor(total / 60);
         const secs = String(total % 60).padStart(2, '0');
         remainingText = `${mins}:${secs}`;
-        deadlineAttr = ` data-mid="${String(m.id)}" data-deadline="${clientDeadline}"`;
+        deadline = clientDeadline;
       }
     }
 
-const statusCell = statusPill(status);
+    let row = machineRowMap.get(id);
+    if (!row) {
+      row = document.createElement('tr');
+      row.innerHTML = '<td></td><td></td><td class="mono"></td>';
+      machineRowMap.set(id, row);
+    }
+    // Keep server order without re-appending rows that are already in place
+    if (machinesTbody.children[idx] !== row) {
+      machinesTbody.insertBefore(row, machinesTbody.children[idx] || null);
+    }
+
+    if (row.cells[0].textContent !== machineName) row.cells[0].textContent = machineName;
+    if (row.dataset.state !== status) {
+      row.cells[1].innerHTML = statusPill(status);
+      row.dataset.state = status;
+    }
 
+    const td = row.cells[2];
+    td._deadline = deadline;
+    if (deadline) {
+      td.dataset.mid = id;
+      if (td.dataset.deadline !== String(deadline)) td.dataset.deadline = String(deadline);
+      tickCells.push(td);
+    } else if (td.dataset.mid) {
+      td.removeAttribute('data-mid');
+      td.removeAttribute('data-deadline');
+    }
+    if (td.textContent !== remainingText) {
+      td.textContent = remainingText;
+      td._lastSec = -1;
+    }
+  });
 
-    return `
-      <tr>
-        <td>${machineName}</td>
-        <td>${statusCell}</td>
-        <td class="mono"${deadlineAttr}>${remainingText}</td>
-      </tr>`;
-  }).join("");
+  // Drop rows for machines that are no longer reported
+  for (const [id, row] of machineRowMap) {
+    if (!seen.has(id)) {
+      row.remove();
+      machineRowMap.delete(id);
+    }
+  }
 
-  host.innerHTML = `
-    <table>
-      <thead>
-        <tr>
-          <th>Machine</th>
-          <th>Status</th>
-          <th>Remaining</th>
-        </tr>
-      </thead>
-      <tbody>${rows}</tbody>
-    </table>
-  `;
+  // Ticker cell list is rebuilt only here, from the rows just patched
+  deadlineCells = tickCells;
 }
 
 async function cat(file, where) {
@@ -3176,15 +4491,18 @@ async function uploadAuto() {
 
     if (!file) return; 
 
-    const buf = await file.arrayBuffer();
-
     let targetHint = '';
     const lower = (file.name || '').toLowerCase();
     if (lower.includes('account')) targetHint = 'accounts';
     else if (lower.includes('trans')) targetHint = 'transactions';
 
     const url = './upload_auto' + (targetHint ? `?target=${targetHint}` : '');
-    const res = await fetch(url, { method: 'PUT', body: buf });
+    // File gövdesi doğrudan gönderilir; tarayıcı belleğe okumadan akıtır
+    const res = await fetch(url, {
+      method: 'PUT',
+      body: file,
+      headers: { 'Content-Type': 'text/csv' },
+    });
 
     if (!res.ok) {
       const txt = await res.text();
@@ -3196,7 +4514,7 @@ async function uploadAuto() {
     alert(`Uploaded as ${js.target}.csv (${js.bytes} bytes)`);
 
     try { await cat(js.target, 'data'); } catch(_) {}
-    renderHistory(); 
+    scheduleRender(renderHistory);
     } catch (err) {
       console.error(err);
       alert('Upload succeeded but UI refresh failed.'); // gerçek durumu söyle
@@ -3206,17 +4524,15 @@ async function uploadAuto() {
 
 
 async function refresh() {
-  await renderMachines();
-  await renderHistory();
+  await Promise.all([renderMachines(), renderHistory()]);
   if (typeof fitCanvasToCards === 'function') {
     setTimeout(fitCanvasToCards, 0);
     setTimeout(fitCanvasToCards, 120);
   }
 }
-refresh();
-loadConfig();
-initUsersUI();
+// Initial load: machines, history, config and accounts fetch in parallel
 initQuickChargeValidators();
+Promise.all([refresh(), loadConfig(), initUsersUI()]).catch(console.error);
 
 (function () {
   function initDownloadMenu() {
@@ -3226,8 +4542,21 @@ initQuickChargeValidators();
     const menu     = document.getElementById('dl_menu');       // dropdown list
     if (!box || !btnMain || !btnCaret || !menu) return;
 
-    const open  = () => box.classList.add('open');
-    const close = () => box.classList.remove('open');
+    // Dışarı tıklama & Esc dinleyicileri yalnızca menü açıkken bağlı
+    const onOutside = (e) => { if (!box.contains(e.target)) close(); };
+    const onKey     = (e) => { if (e.key === 'Escape') close(); };
+
+    const open = () => {
+      if (box.classList.contains('open')) return;
+      box.classList.add('open');
+      document.addEventListener('pointerdown', onOutside, true);
+      document.addEventListener('keydown', onKey);
+    };
+    const close = () => {
+      box.classList.remove('open');
+      document.removeEventListener('pointerdown', onOutside, true);
+      document.removeEventListener('keydown', onKey);
+    };
 
     // Ana buton: varsayılan indirme (Accounts)
     btnMain.addEventListener('click', (e) => {
@@ -3238,7 +4567,7 @@ initQuickChargeValidators();
     // Ok butonu menüyü aç/kapat
     btnCaret.addEventListener('click', (e) => {
       e.preventDefault();
-      box.classList.toggle('open');
+      if (box.classList.contains('open')) close(); else open();
     });
 
     // Menü seçimleri
@@ -3250,10 +4579,6 @@ initQuickChargeValidators();
       if (file) window.location.href = `./download?file=${file}`;
       close();
     });
-
-    // Dışarı tıklama & Esc ile kapat
-    document.addEventListener('click', (e) => { if (!box.contains(e.target)) close(); });
-    document.addEventListener('keydown', (e) => { if (e.key === 'Escape') close(); });
   }
 
   if (document.readyState === 'loading') {
@@ -3264,7 +4589,59 @@ initQuickChargeValidators();
 })();
 
 /* --------- Canvas auto-fit (page grows with free-positioned cards) --------- */
+// Cards are watched by one shared ResizeObserver + MutationObserver; the fit
+// only does work after one of them flagged a geometry change.
+let fitCanvasDirty = true;
+let cardResizeObs = null;
+let cardMutationObs = null;
+
+let fitCanvasRaf = 0;
+let fitCanvasHold = false;   // set while a card is dragged/resized; refit on release
+
+// Observer callbacks run after the caller's own fit, so schedule one more.
+function markCanvasDirty() {
+  fitCanvasDirty = true;
+  if (fitCanvasRaf || fitCanvasHold) return;
+  fitCanvasRaf = requestAnimationFrame(() => {
+    fitCanvasRaf = 0;
+    fitCanvasToCards();
+  });
+}
+
+function invalidateCardPositions() {
+  document.querySelectorAll('.card').forEach(el => { delete el.dataset.posCache; });
+  fitCanvasDirty = true;
+}
+
+function observeCardGeometry(el) {
+  if (!cardResizeObs && window.ResizeObserver) {
+    cardResizeObs = new ResizeObserver(markCanvasDirty);
+  }
+  if (!cardMutationObs && window.MutationObserver) {
+    cardMutationObs = new MutationObserver(records => {
+      for (const r of records) {
+        if (r.attributeName === 'class') delete r.target.dataset.posCache;
+      }
+      markCanvasDirty();
+    });
+  }
+  cardResizeObs?.observe(el);
+  cardMutationObs?.observe(el, { attributes: true, attributeFilter: ['style', 'class'] });
+}
+
+function cardPosition(el) {
+  let pos = el.dataset.posCache;
+  if (!pos) {
+    pos = window.getComputedStyle(el).position;
+    el.dataset.posCache = pos;
+  }
+  return pos;
+}
+
 function fitCanvasToCards() {
+  if (!fitCanvasDirty) return;
+  fitCanvasDirty = false;
+
   // Prefer a dedicated host if present; otherwise fall back to the grid or body
   const host =
       document.getElementById('freeLayoutHost') ||
@@ -3273,17 +4650,15 @@ function fitCanvasToCards() {
       document.body;
 
 
-  // Measure absolutely/fixed positioned cards
-  const cards = Array.from(document.querySelectorAll('.card'));
+  // Measure absolutely/fixed positioned cards (all reads before any write)
+  const cards = document.querySelectorAll('.card');
+  const scrollY = window.scrollY;
   let maxBottom = 0;
 
   cards.forEach(el => {
-    const style = window.getComputedStyle(el);
-    const isAbs = style.position === 'absolute' || style.position === 'fixed';
-    const rect = el.getBoundingClientRect();
-    const bottom = window.scrollY + rect.bottom;
-    if (isAbs) {
-      maxBottom = Math.max(maxBottom, bottom);
+    const pos = cardPosition(el);
+    if (pos === 'absolute' || pos === 'fixed') {
+      maxBottom = Math.max(maxBottom, scrollY + el.getBoundingClientRect().bottom);
     }
   });
 
@@ -3300,11 +4675,26 @@ function fitCanvasToCards() {
   }
 }
 
-// Refitting on resize (debounced lightly)
-window.addEventListener('resize', () => {
-  fitCanvasToCards();
-  setTimeout(fitCanvasToCards, 100);
-});
+// Refitting on resize: trailing-edge debounce. Instead of clearing and
+// re-arming a timer on every event, let the pending timer fire and re-arm it
+// only for the time remaining since the last resize.
+const FIT_DEBOUNCE_MS = 100;
+let fitResizeTimer = 0;
+let fitResizeLast = 0;
+function fitCanvasOnResize() {
+  fitResizeLast = performance.now();
+  if (fitResizeTimer) return;
+  fitResizeTimer = setTimeout(function run() {
+    const wait = FIT_DEBOUNCE_MS - (performance.now() - fitResizeLast);
+    if (wait <= 0) {
+      fitResizeTimer = 0;
+      fitCanvasToCards();
+    } else {
+      fitResizeTimer = setTimeout(run, wait);
+    }
+  }, FIT_DEBOUNCE_MS);
+}
+window.addEventListener('resize', fitCanvasOnResize);
 
 // First paint: run once the DOM and initial async renders settle
 if (document.readyState === 'loading') {
@@ -3335,6 +4725,31 @@ if (document.readyState === 'loading') {
     localStorage.setItem(LKEY, JSON.stringify(state || {}));
   }
 
+  // In-memory copy of the saved layout; localStorage is only read once and
+  // written on drag/resize release.
+  let LAYOUT_STATE = null;
+  function layoutState(){
+    if (!LAYOUT_STATE) LAYOUT_STATE = loadLayout();
+    return LAYOUT_STATE;
+  }
+
+  // Coalesce storage writes: at most one per 500 ms, flushed when the page hides
+  let pendingLayout = null;
+  let saveTimer = 0;
+  function scheduleSave(state){
+    pendingLayout = state;
+    if (!saveTimer) saveTimer = setTimeout(flushSave, 500);
+  }
+  function flushSave(){
+    if (saveTimer) { clearTimeout(saveTimer); saveTimer = 0; }
+    if (!pendingLayout) return;
+    const state = pendingLayout;
+    pendingLayout = null;
+    try { saveLayout(state); } catch(_) {}
+  }
+  window.addEventListener('pagehide', flushSave);
+  document.addEventListener('visibilitychange', () => { if (document.hidden) flushSave(); });
+
   function defaultPositions(){
     const W = CANVAS.clientWidth || 1200;
     const col = Math.max(360, Math.min(560, Math.floor(W/2)-24));
@@ -3348,17 +4763,24 @@ if (document.readyState === 'loading') {
     };
   }
 
+  // The applied geometry is kept on the element: offsetLeft/Top no longer
+  // reflect the transform, and persist() saves it without reading layout.
   function applyGeom(el, g){
     if(!g) return;
-    el.style.left   = (g.x|0) + 'px';
-    el.style.top    = (g.y|0) + 'px';
+    el._gx = g.x|0;
+    el._gy = g.y|0;
+    el._geom = { x: el._gx, y: el._gy, w: Math.max(320, g.w|0), h: g.h|0 };
+    el.style.setProperty('--win-x', el._gx + 'px');
+    el.style.setProperty('--win-y', el._gy + 'px');
     el.style.width  = Math.max(320, g.w|0) + 'px';
     el.style.height = 'auto';
   }
 
+  // The set of cards is static: query it once and reuse the array
+  let WINS = null;
   function collectCards(){
-    const wins = document.querySelectorAll('[data-win]');
-    wins.forEach(w => {
+    if (!WINS) WINS = Array.from(document.querySelectorAll('[data-win]'));
+    WINS.forEach(w => {
       if (w.parentElement !== CANVAS){
         CANVAS.appendChild(w);
       }
@@ -3370,10 +4792,14 @@ if (document.readyState === 'loading') {
     el.style.zIndex = String(zCounter);
   }
 
-  function boundRect(g){
+  // Round to the 10px grid (integer math; callers clamp the result anyway)
+  function snap10(v){
+    return ((v / 10 + 0.5) | 0) * 10;
+  }
+
+  // W/H are the canvas size captured when the gesture started
+  function boundRect(g, W, H){
     const pad = 6;
-    const W = CANVAS.clientWidth;
-    const H = CANVAS.clientHeight;
     g.w = Math.max(320, Math.min(g.w, W - g.x - pad));
     // g.h = Math.max(140, Math.min(g.h, H - g.y - pad));
     g.x = Math.max(pad, Math.min(g.x, W - 320));
@@ -3381,121 +4807,116 @@ if (document.readyState === 'loading') {
     return g;
   }
 
-  function initWin(el){
+  function initWin(el, defaults){
     const id = el.getAttribute('data-win');
-    const title = el.querySelector('.win-title') || el;
-    const handle = el.querySelector('.resize-handle');
-
-    const gAll = loadLayout();
-    const g = gAll[id] || defaultPositions()[id];
+    const gAll = layoutState();
+    const g = gAll[id] || (defaults || defaultPositions())[id];
     applyGeom(el, g);
+    if (el._winReady) return;
+    el._winReady = true;
+    observeCardGeometry(el);
+  }
+
+  function persist(el){
+    layoutState()[el.getAttribute('data-win')] = { ...el._geom };
+    scheduleSave(LAYOUT_STATE);
+  }
 
-    // Drag
-    let dx=0, dy=0, dragging=false;
-    function onDown(e){
-      dragging = true;
-      bringToFront(el);
-      el.classList.add('dragging');
+  // Drag/resize: one delegated pointerdown on the canvas and a single shared
+  // gesture state. Geometry is read once on press; moves only record the
+  // pointer and the style write happens at most once per animation frame.
+  // Pointer capture keeps move/up on the pressed element; they bubble here.
+  const G = {
+    mode: '', el: null,
+    dx: 0, dy: 0, rx: 0, ry: 0, w: 0, h: 0, CW: 0, CH: 0,
+    canvasRect: null, pending: null, raf: 0
+  };
+
+  function gestureDown(e){
+    if (e.button > 0 || G.mode) return;
+    const el = e.target.closest('[data-win]');
+    if (!el || !el._winReady) return;
+    const handle = e.target.closest('.resize-handle');
+    const title = handle ? null : (e.target.closest('.win-title') || (el.querySelector('.win-title') ? null : el));
+    if (!handle && !title) return;
+
+    G.mode = handle ? 'resize' : 'drag';
+    G.el = el;
+    G.CW = CANVAS.clientWidth; G.CH = CANVAS.clientHeight;
+    G.w = el.offsetWidth; G.h = el.offsetHeight;
+    if (G.mode === 'drag'){
       const r = el.getBoundingClientRect();
-      const baseX = e.touches ? e.touches[0].clientX : e.clientX;
-      const baseY = e.touches ? e.touches[0].clientY : e.clientY;
-      dx = baseX - r.left;
-      dy = baseY - r.top;
-      window.addEventListener('mousemove', onMove);
-      window.addEventListener('mouseup', onUp);
-      window.addEventListener('touchmove', onMove, {passive:false});
-      window.addEventListener('touchend', onUp);
-      e.preventDefault?.();
-    }
-    function onMove(e){
-      if(!dragging) return;
-      e.preventDefault?.();
-      const baseX = e.touches ? e.touches[0].clientX : e.clientX;
-      const baseY = e.touches ? e.touches[0].clientY : e.clientY;
-      const c = CANVAS.getBoundingClientRect();
-      let x = (baseX - c.left) - dx;
-      let y = (baseY - c.top)  - dy;
-      x = Math.round(x/10)*10;
-      y = Math.round(y/10)*10;
-      const cur = { x, y, w: el.offsetWidth, h: el.offsetHeight };
-      boundRect(cur);
-      applyGeom(el, cur);
-    }
-    function onUp(){
-      if(!dragging) return;
-      dragging = false;
-      el.classList.remove('dragging');
-      window.removeEventListener('mousemove', onMove);
-      window.removeEventListener('mouseup', onUp);
-      window.removeEventListener('touchmove', onMove);
-      window.removeEventListener('touchend', onUp);
-      persist();
-    }
-    title.addEventListener('mousedown', onDown);
-    title.addEventListener('touchstart', onDown, {passive:false});
-
-    // Resize
-    if(handle){
-      let rx=0, ry=0, rw=0, rh=0, resizing=false;
-      function rDown(e){
-        resizing = true;
-        bringToFront(el);
-        const baseX = e.touches ? e.touches[0].clientX : e.clientX;
-        const baseY = e.touches ? e.touches[0].clientY : e.clientY;
-        rx = baseX; ry = baseY; rw = el.offsetWidth; rh = el.offsetHeight;
-        window.addEventListener('mousemove', rMove);
-        window.addEventListener('mouseup', rUp);
-        window.addEventListener('touchmove', rMove, {passive:false});
-        window.addEventListener('touchend', rUp);
-        e.preventDefault?.();
-      }
-      function rMove(e){
-        if(!resizing) return;
-        const baseX = e.touches ? e.touches[0].clientX : e.clientX;
-        const baseY = e.touches ? e.touches[0].clientY : e.clientY;
-        let w = rw + (baseX - rx);
-        let h = rh + (baseY - ry);
-        w = Math.round(w/10)*10;
-        h = Math.round(h/10)*10;
-        const cur = { x: el.offsetLeft, y: el.offsetTop, w, h };
-        boundRect(cur);
-        applyGeom(el, cur);
-      }
-      function rUp(){
-        if(!resizing) return;
-        resizing = false;
-        window.removeEventListener('mousemove', rMove);
-        window.removeEventListener('mouseup', rUp);
-        window.removeEventListener('touchmove', rMove);
-        window.removeEventListener('touchend', rUp);
-        persist();
-      }
-      handle.addEventListener('mousedown', rDown);
-      handle.addEventListener('touchstart', rDown, {passive:false});
+      G.canvasRect = CANVAS.getBoundingClientRect();
+      G.dx = e.clientX - r.left;
+      G.dy = e.clientY - r.top;
+      el.dataset.dragging = '1';
+    } else {
+      G.rx = e.clientX; G.ry = e.clientY;
     }
+    fitCanvasHold = true;
+    bringToFront(el);
+    (handle || title).setPointerCapture(e.pointerId);
+    e.preventDefault();
+  }
 
-    function persist(){
-      const all = loadLayout();
-      all[id] = { x: el.offsetLeft, y: el.offsetTop, w: el.offsetWidth, h: el.offsetHeight };
-      saveLayout(all);
-    }
+  function gestureMove(e){
+    if (!G.mode) return;
+    G.pending = { x: e.clientX, y: e.clientY };
+    if (!G.raf) G.raf = requestAnimationFrame(gestureFlush);
+  }
+
+  function gestureFlush(){
+    G.raf = 0;
+    const p = G.pending;
+    if (!p) return;
+    G.pending = null;
+    const el = G.el;
+    const cur = (G.mode === 'drag')
+      ? { x: snap10((p.x - G.canvasRect.left) - G.dx),
+          y: snap10((p.y - G.canvasRect.top)  - G.dy),
+          w: G.w, h: G.h }
+      : { x: el._gx, y: el._gy,
+          w: snap10(G.w + (p.x - G.rx)),
+          h: snap10(G.h + (p.y - G.ry)) };
+    boundRect(cur, G.CW, G.CH);
+    applyGeom(el, cur);
+  }
+
+  function gestureUp(){
+    if (!G.mode) return;
+    if (G.raf) { cancelAnimationFrame(G.raf); G.raf = 0; }
+    gestureFlush();
+    delete G.el.dataset.dragging;
+    fitCanvasHold = false;
+    persist(G.el);
+    G.mode = ''; G.el = null; G.canvasRect = null;
+    fitCanvasToCards();
   }
 
+  CANVAS.addEventListener('pointerdown', gestureDown);
+  CANVAS.addEventListener('pointermove', gestureMove);
+  CANVAS.addEventListener('pointerup', gestureUp);
+  CANVAS.addEventListener('pointercancel', gestureUp);
+
   function activateLayout(){
     document.body.classList.add('layout-active');
     CANVAS.style.display = 'block';
+    invalidateCardPositions();
     collectCards();
-    const stored = loadLayout();
-    if (!Object.keys(stored).length){
-      saveLayout(defaultPositions());
+    // Defaults depend only on the canvas width: compute them once per activation
+    const def = defaultPositions();
+    if (!Object.keys(layoutState()).length){
+      LAYOUT_STATE = { ...def };
+      saveLayout(LAYOUT_STATE);
     }
-    document.querySelectorAll('[data-win]').forEach(el => initWin(el));
+    WINS.forEach(el => initWin(el, def));
     BTN_TOGGLE.textContent = 'Close Layout Mode';
   }
 
   function deactivateLayout(){
   document.body.classList.remove('layout-active');  // grid’e geri dön
   CANVAS.style.display = 'none';
+  invalidateCardPositions();
   BTN_TOGGLE.textContent = 'Customize Layout';
 }
 
@@ -3509,13 +4930,13 @@ if (document.readyState === 'loading') {
 
   BTN_RESET.addEventListener('click', () => {
     if (!confirm('Reset saved layout?')) return;
-    saveLayout({});
     const def = defaultPositions();
-    document.querySelectorAll('[data-win]').forEach(el => {
+    (WINS || []).forEach(el => {
       const id = el.getAttribute('data-win');
       applyGeom(el, def[id] || {x:12,y:12,w:520,h:260});
     });
-    saveLayout(def);
+    LAYOUT_STATE = def;
+    scheduleSave(def);
   });
 
   // Auto-activate if a layout exists
@@ -3627,62 +5048,77 @@ document.addEventListener('click', (e) => {
 
 </body>
 </html>
-""")
+"""
+_ROOT_HTML_BYTES = _ROOT_HTML.encode("utf-8")
+_ROOT_ETAG = '"' + hashlib.blake2b(_ROOT_HTML_BYTES, digest_size=8).hexdigest() + '"'
+
+@app.get("/", response_class=HTMLResponse)
+def root_ui(request: Request):
+    # no-cache = always revalidate: cheap 304s, but never a stale panel after an update
+    headers = {"ETag": _ROOT_ETAG, "Cache-Control": "no-cache"}
+    inm = request.headers.get("if-none-match") or ""
+    if inm == "*" or _ROOT_ETAG in inm:  # also matches W/"..." and lists
+        return Response(status_code=304, headers=headers)
+    return Response(_ROOT_HTML_BYTES, media_type="text/html; charset=utf-8", headers=headers)
 
 @app.get("/machines")
-def machines():
-    opts = _read_options()
-    wm = [str(x) for x in (opts.get("washing_machines") or [1, 2, 3])]
-    dm = [str(x) for x in (opts.get("dryer_machines") or [4, 5, 6])]
-    ids = wm + dm
+async def machines():
+    opts = _read_options_cached()
+    ids, wm_set = _machine_ids(opts)
 
     has_token = bool(_resolve_token(opts.get("ha_token")))  # env-aware token check
+    has_adam = bool((opts.get("adam_host") or "").strip())
+    has_source = bool(opts.get("simulate") or has_token or has_adam)
     mode = str(opts.get("do_mode") or "pulse").lower()
     out = []
 
-    def _soft_busy(mid: str) -> bool:
-        try:
-            return time.time() < float(ACTIVE_UNTIL.get(mid, 0))
-        except Exception:
-            return False
+    async def _skip():
+        return None
 
-    # remaining seconds helper
-    def _remaining_seconds(mid: str) -> int:
-        try:
-            rem = int(float(ACTIVE_UNTIL.get(mid, 0)) - time.time())
-            return rem if rem > 0 else 0
-        except Exception:
-            return 0
+    async def _value(v):
+        return v
+
+    # Static per-machine info first. All DIs then come from one Modbus request;
+    # HA states come from the state watcher, and only the ones it doesn't have
+    # are fetched over REST, concurrently in worker threads.
+    plan = []
+    dis = []
+    ha_reads = []
+    for mid in ids:
+        switch, sensor, price, minutes, enabled, di = _machine_info(mid, opts)
+        plan.append((mid, switch, sensor, price, minutes, enabled, di))
+        if enabled and has_adam and di is not None:
+            dis.append(di)
+        cached = _ha_cached_state(sensor) if enabled and has_token else None
+        if cached is not None:
+            ha_reads.append(_value(cached))
+        else:
+            ha_reads.append(asyncio.to_thread(_get_state, sensor, opts)
+                            if enabled and has_token else _skip())
+    di_vals, *ha_states = await asyncio.gather(
+        asyncio.to_thread(_adam_read_dis, dis, opts) if dis else _skip(), *ha_reads)
+    di_vals = di_vals or {}
+
+    # Timer-based soft busy: one clock read and one copy of ACTIVE_UNTIL
+    # (written by charge threads) for the whole response
+    now = time.time()
+    active_until = {k: v for k, v in ACTIVE_UNTIL.copy().items() if now < v}
 
-    for mid in sorted(ids, key=lambda s: int(s)):
-        switch, sensor = _machine_entities(mid, opts)
-        try_price = _price_for(mid, opts)
+    for i, (mid, switch, sensor, try_price, minutes, enabled, di) in enumerate(plan):
 
         # Defaults
         state = "unknown"
         busy_source = "unknown"
 
         # Disabled machine
-        if not machine_enabled(mid, opts):
+        if not enabled:
             err = "disabled"
             state = "disabled"
         else:
-            # Prepare sources
-            has_adam = bool((opts.get("adam_host") or "").strip())
-            r, di = _machine_adam_mapping(mid, opts)
-            di_val = None  # True=active, False=inactive, None=unknown
-
-            # Read ADAM DI (if present)
-            if has_adam and di is not None:
-                di_val = _adam_read_di(di, opts)
-
-            # Read from HA sensor (if token present)
-            ha_state = None
-            if has_token:
-                ha_state = _get_state(sensor, opts)  # "on"/"off"/"unknown"/None
+            di_val = di_vals.get(di)  # True=active, False=inactive, None=unknown
+            ha_state = ha_states[i]   # "on"/"off"/"unknown"/None
 
-            # Timer-based soft busy
-            soft = _soft_busy(mid)
+            soft = mid in active_until
 
             # ---- Decision logic ----
             if mode == "hold":
@@ -3693,13 +5129,13 @@ def machines():
                     # DI inactive; if timer exists it's busy, else try HA; else 'off'
                     if soft:
                         state, busy_source = "on", "timer"
-                    elif ha_state in ("on", "off"):
+                    elif ha_state in _ONOFF:
                         state, busy_source = ha_state, "ha"
                     else:
                         state, busy_source = "off", "di"
                 else:
                     # DI unknown -> prefer HA, then timer, else UNKNOWN (not off)
-                    if ha_state in ("on", "off"):
+                    if ha_state in _ONOFF:
                         state, busy_source = ha_state, "ha"
                     elif soft:
                         state, busy_source = "on", "timer"
@@ -3716,28 +5152,24 @@ def machines():
                         state, busy_source = "on", "di"
                     elif di_val is False:
                         state, busy_source = "off", "di"
-                    elif ha_state in ("on", "off"):
+                    elif ha_state in _ONOFF:
                         state, busy_source = ha_state, "ha"
                     else:
                         state, busy_source = "unknown", "none"
 
-            err = (
-                "disabled"
-                if not machine_enabled(mid, opts)
-                else ("" if (opts.get("simulate") or has_token or (opts.get("adam_host") or "").strip()) else "no_token")
-            )
+            err = "" if has_source else "no_token"
 
         out.append({
             "id": mid,
-            "category": "washing" if mid in wm else "dryer",
+            "category": "washing" if mid in wm_set else "dryer",
             "ha_switch": switch,
             "ha_sensor": sensor,
             "state": state,                 # "on"/"off"/"disabled"/"unknown"
             "busy_source": busy_source,     # "di"/"timer"/"ha"/"none"/"unknown"
             "price": try_price,
-            "default_minutes": _default_minutes_for(mid, opts),
+            "default_minutes": minutes,
             "error": err,
-            "remaining_seconds": _remaining_seconds(mid)
+            "remaining_seconds": int(active_until[mid] - now) if mid in active_until else 0
         })
 
     return {"ok": True, "machines": out, "simulate": bool(opts.get("simulate", False))}
@@ -3769,7 +5201,7 @@ def accounts_upsert(acc: dict):
             "balance": float(balance),
             "last_transaction_utc": now_iso
         }
-        write_accounts(accounts)
+        _stage_accounts(accounts)
 
     return {
         "ok": True,
@@ -3810,7 +5242,7 @@ def accounts_create(acc: dict):
             "balance": float(balance),
             "last_transaction_utc": now_iso
         }
-        write_accounts(accounts)
+        _stage_accounts(accounts)
 
     return {
         "ok": True,
@@ -3821,14 +5253,34 @@ def accounts_create(acc: dict):
     }
 
 
+# Serialized /accounts/list body, keyed by the staged snapshot (identity) or
+# by accounts.csv's stat stamp when nothing is staged.
+_ACCOUNTS_JSON: Tuple[object, bytes] = (None, b"")
+
 @app.get("/accounts/list")
 def accounts_list():
-    return {"ok": True, "accounts": read_accounts()}
+    global _ACCOUNTS_JSON
+    with _ACCOUNTS_LOCK:
+        pending = _ACCOUNTS_PENDING
+    if pending is not None:
+        key: object = pending
+    else:
+        try:
+            st = ACCOUNTS_PATH.stat()
+            key = (st.st_mtime_ns, st.st_size, st.st_ino)
+        except FileNotFoundError:
+            key = ()
+    cached_key, body = _ACCOUNTS_JSON
+    if not (cached_key is key or (pending is None and cached_key == key)):
+        payload = {"ok": True, "accounts": read_accounts()}
+        body = _json_dumps(payload)
+        _ACCOUNTS_JSON = (key, body)
+    return Response(body, media_type="application/json")
 
 # ----------------------- Config --------------------------
 @app.get("/config")
 def get_config():
-    opts = _read_options()
+    opts = _read_options_cached()
     keys = [
         "washing_machines","dryer_machines","washing_minutes","dryer_minutes",
         "price_washing","price_dryer","price_map","disabled_machines","simulate",
@@ -3843,7 +5295,8 @@ def get_config():
 
 @app.post("/config")
 def set_config(payload: dict):
-    opts = _read_options()
+    current = _read_options()
+    opts = dict(current)
     patch = dict(payload)
     if "washing_machines" in patch:
         patch["washing_machines"] = [int(x) for x in patch["washing_machines"]]
@@ -3858,7 +5311,8 @@ def set_config(payload: dict):
         patch["confirm_keys"] = [int(x) for x in patch["confirm_keys"]]
         
     opts.update(patch)
-    _write_options(opts)
+    if opts != current:  # no-op saves (UI re-sending the same values) skip the write
+        _write_options(opts)
     return {"ok": True, "saved": patch}
 
 # ----------------------- Charge flow ---------------------
@@ -3882,7 +5336,7 @@ def charge(request: Request, req: dict = Body(...)):
     if not tenant_code or not machine:
         raise HTTPException(status_code=400, detail="INVALID_INPUT")
 
-    opts = _read_options()
+    opts = _read_options_cached()
     price = req.get("price", None)
     minutes = req.get("cycle_minutes", None)
 
@@ -3920,17 +5374,37 @@ def simulate_charge(
 
 # ----------------------- History & Debug -----------------
 @app.get("/history")
-def history(limit: int = Query(50, ge=1, le=1000)):
-    return {"ok": True, "items": tail_transactions(limit)}
+def history(limit: int = Query(50, ge=1, le=1000), offset: int = Query(0, ge=0)):
+    return {"ok": True, "items": tail_transactions(limit, offset)}
+
+@app.get("/history/stream")
+def history_stream(limit: int = Query(0, ge=0), offset: int = Query(0, ge=0)):
+    """Transactions newest first as NDJSON; limit=0 streams the whole ledger."""
+    return StreamingResponse(stream_transactions(limit, offset), media_type="application/x-ndjson")
+
+# /debug/cat bodies keyed by path -> ((mtime_ns, size, ino), bytes). Only the
+# four data/share CSV paths can be requested, so no eviction is needed.
+_CAT_CACHE: Dict[Path, Tuple[Tuple[int, int, int], bytes]] = {}
 
 @app.get("/debug/cat")
 def debug_cat(file: str = Query(..., pattern="^(accounts|transactions)$"), where: str = Query("data")):
     path = (ACCOUNTS_PATH if file=="accounts" else TRANSACTIONS_PATH)
     if where == "share":
         path = (SHARE_ACCOUNTS if file=="accounts" else SHARE_TX)
-    if not path.exists():
+    if file == "transactions":
+        flush_transactions()
+    else:
+        flush_accounts()  # staged upserts/charges belong in what we show
+    try:
+        st = path.stat()
+    except FileNotFoundError:
         return JSONResponse({"error": f"{path} not found"}, status_code=404)
-    return PlainTextResponse(path.read_text(encoding="utf-8"))
+    stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+    cached = _CAT_CACHE.get(path)
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, path.read_bytes())
+        _CAT_CACHE[path] = cached
+    return PlainTextResponse(cached[1])
 
 @app.get("/debug/where")
 def debug_where():
@@ -3939,6 +5413,8 @@ def debug_where():
             return {"path": str(p), "exists": p.exists(), "size": p.stat().st_size if p.exists() else 0, "mtime": p.stat().st_mtime if p.exists() else 0}
         except Exception as e:
             return {"path": str(p), "error": str(e)}
+    flush_accounts()
+    flush_transactions()
     return {
         "data": {"accounts": info(ACCOUNTS_PATH), "transactions": info(TRANSACTIONS_PATH)},
         "share": {"accounts": info(SHARE_ACCOUNTS), "transactions": info(SHARE_TX)}
@@ -3947,19 +5423,73 @@ def debug_where():
 @app.get("/download")
 def download(file: str = Query(..., pattern="^(accounts|transactions)$")):
     path = ACCOUNTS_PATH if file=="accounts" else TRANSACTIONS_PATH
+    if file == "transactions":
+        flush_transactions()
+    else:
+        flush_accounts()
     if not path.exists():
         raise HTTPException(status_code=404, detail="FILE_NOT_FOUND")
-    filename = f"{file}.csv"
-    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
-    def iterfile():
-        with path.open("rb") as f:
-            while True:
-                chunk = f.read(8192)
-                if not chunk: break
-                yield chunk
-    return StreamingResponse(iterfile(), media_type="text/csv", headers=headers)
+    # FileResponse hands the file to the server in large chunks (sendfile where available)
+    return FileResponse(path, media_type="text/csv", filename=f"{file}.csv")
 
 # ----------------------- Upload --------------------------
+UPLOAD_MAX_BYTES = 15 * 1024 * 1024
+
+async def _stream_upload(request: Request, f) -> Tuple[int, str]:
+    """
+    Copy the request body into the open binary file `f` chunk by chunk:
+    UTF-8 BOM stripped, invalid bytes dropped, CRLF/CR unified to LF.
+    Returns (bytes_written, first_line). Raises 413 as soon as the raw body
+    exceeds UPLOAD_MAX_BYTES, or before reading anything if Content-Length
+    already says it will.
+    """
+    try:
+        declared = int(request.headers.get("content-length") or -1)
+    except ValueError:
+        declared = -1
+    if declared > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="FILE_TOO_LARGE")
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="ignore")
+    raw = written = 0
+    carry_cr = False          # a trailing '\r' may be the first half of a CRLF
+    head: List[str] = []      # text of the first line, until its '\n' arrives
+    head_done = False
+
+    def _emit(text: str, final: bool) -> None:
+        nonlocal carry_cr, written, head_done
+        if carry_cr:
+            text = "\r" + text
+            carry_cr = False
+        if not final and text.endswith("\r"):
+            text = text[:-1]
+            carry_cr = True
+        if not text:
+            return
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+        if not head_done:
+            nl = text.find("\n")
+            if nl >= 0:
+                head.append(text[:nl])
+                head_done = True
+            else:
+                head.append(text)
+        data = text.encode("utf-8")
+        f.write(data)
+        written += len(data)
+
+    async for chunk in request.stream():
+        if not chunk:
+            continue
+        raw += len(chunk)
+        if raw > UPLOAD_MAX_BYTES:  # ↑ 15MB
+            raise HTTPException(status_code=413, detail="FILE_TOO_LARGE")
+        _emit(decoder.decode(chunk), final=False)
+    if raw == 0:
+        raise HTTPException(status_code=400, detail="EMPTY_BODY")
+    _emit(decoder.decode(b"", final=True), final=True)
+    return written, "".join(head)
+
+
 @app.put("/upload_raw")
 async def upload_raw(
     request: Request,
@@ -3981,27 +5511,32 @@ async def upload_raw(
     """
     ensure_bootstrap_files()
 
-    # --- read body (raw bytes) ---
-    body = await request.body()
-    if not body:
-        raise HTTPException(status_code=400, detail="EMPTY_BODY")
-    if len(body) > 15 * 1024 * 1024:  # ↑ 15MB
-        raise HTTPException(status_code=413, detail="FILE_TOO_LARGE")
+    # --- stream body into a staging file next to the targets (same filesystem) ---
+    fd, staging_name = tempfile.mkstemp(dir=str(DATA_DIR), prefix=".upload.", suffix=".csv.up")
+    staging = Path(staging_name)
+    try:
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "wb") as f:
+            written, first_line = await _stream_upload(request, f)
+            f.flush(); os.fsync(f.fileno())
+        if not written:
+            raise HTTPException(status_code=400, detail="EMPTY_FILE")
+        return _commit_upload(staging, written, first_line.strip().lower(), target)
+    finally:
+        staging.unlink(missing_ok=True)
 
-    # Normalize text: strip UTF-8 BOM and unify newlines
-    text = body.decode("utf-8-sig", errors="ignore").replace("\r\n", "\n").replace("\r", "\n")
-    lines = text.splitlines()
-    if not lines:
-        raise HTTPException(status_code=400, detail="EMPTY_FILE")
 
-    header = lines[0].strip().lower()
+def _commit_upload(staging: Path, written: int, header: str, target: Optional[str]) -> dict:
+    """Validate the staged upload's header and move it over the target CSV."""
+    # --- helpers for header checks: exact column names, parsed once ---
+    # (substring tests let "balance_after"/"amount_charged" pass as accounts columns)
+    header_cols = {c.strip() for c in next(csv.reader([header[:4096]]), [])}
 
-    # --- helpers for header checks ---
     def has_all(cols: list[str]) -> bool:
-        return all(col in header for col in cols)
+        return header_cols.issuperset(cols)
 
     def has_any(cols: list[str]) -> bool:
-        return any(col in header for col in cols)
+        return not header_cols.isdisjoint(cols)
 
     # --- auto-detect if needed (more tolerant) ---
     if target is None:
@@ -4014,7 +5549,6 @@ async def upload_raw(
 
     # --- choose paths ---
     path = ACCOUNTS_PATH if target == "accounts" else TRANSACTIONS_PATH
-    tmp = path.with_suffix(".csv.up")
 
     # --- light header validation (prevent wrong file overwrite) ---
     if target == "accounts":
@@ -4024,30 +5558,31 @@ async def upload_raw(
         if not (has_all(["timestamp", "tenant_code"]) and has_any(["machine_number", "machine"])):
             raise HTTPException(status_code=400, detail="INVALID_TRANSACTIONS_HEADER")
 
-    # --- atomic write with backup + mirror ---
-    data_bytes = text.encode("utf-8")  # write normalized content
+    # --- atomic replace with backup; the staging file is already synced, so
+    # the lock only covers flush, link and rename ---
     with file_lock(GLOBAL_LOCK, timeout=10.0):
-        # optional backup of current file (best-effort)
+        if target == "transactions":
+            flush_transactions()  # queued rows belong to the file being replaced
+        # optional backup of current file (best-effort). A hard link is enough:
+        # the live name is about to be pointed at a new inode by os.replace.
         try:
             if path.exists():
                 ts = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
-                bak = path.with_suffix(f".csv.bak.{ts}")
-                bak.write_bytes(path.read_bytes())
+                _clone_file(path, path.with_suffix(f".csv.bak.{ts}"))
         except Exception:
             pass
 
-        with tmp.open("wb") as f:
-            f.write(data_bytes)
-            f.flush(); os.fsync(f.fileno())
-        os.replace(tmp, path)
-
-        # keep mirrors in sync
+        os.replace(staging, path)
         if target == "accounts":
-            (ACCOUNTS_PATH, SHARE_ACCOUNTS)
-        else:
-            (TRANSACTIONS_PATH, SHARE_TX)
+            _discard_pending_accounts()
+
+    # keep mirrors in sync (outside the lock)
+    if target == "accounts":
+        _mirror(ACCOUNTS_PATH, SHARE_ACCOUNTS)
+    else:
+        _schedule_tx_mirror()
 
-    return {"ok": True, "target": target, "bytes": len(data_bytes)}
+    return {"ok": True, "target": target, "bytes": written}
 
 
 @app.put("/upload_auto")